@@ -0,0 +1,69 @@
+# Recompute latency of trading-comps statistics for a filter set: pandas
+# explode + groupby vs comps.CompsEngine (results checked against pandas).
+#
+#   python benchmarks/bench_comps.py [rows ...]
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_filters import best_of, synthetic  # noqa: E402
+from comps import METRIC_COLUMNS, TRIM, CompsEngine  # noqa: E402
+from filters import FilterEngine  # noqa: E402
+
+SIZES = (10_000, 50_000, 200_000)
+SELECTED = {"country": [f"country_{i}" for i in range(30)]}
+
+
+def with_metrics(df, seed=0):
+    rng = np.random.default_rng(seed)
+    for col in METRIC_COLUMNS:
+        values = rng.lognormal(1.5, 0.8, len(df))
+        values[rng.random(len(df)) < 0.2] = np.nan  # missing financials
+        df[col] = values
+    return df
+
+
+def trimmed(s):
+    s = np.sort(s.dropna().to_numpy())
+    cut = int(np.floor(len(s) * TRIM))
+    return s[cut : len(s) - cut].mean() if len(s) else np.nan
+
+
+def pandas_stats(df, mask, by):
+    sub = df[mask].explode(by)
+    grouped = sub.groupby(by)[list(METRIC_COLUMNS)]
+    return pd.concat(
+        {
+            "count": grouped.count(),
+            "mean": grouped.mean(),
+            "median": grouped.median(),
+            "q1": grouped.quantile(0.25),
+            "q3": grouped.quantile(0.75),
+            "trimmed_mean": grouped.agg(trimmed),
+        },
+        axis=1,
+    ).swaplevel(axis=1)
+
+
+def main(sizes):
+    print(f"{'rows':>10} {'pandas (ms)':>12} {'build (ms)':>12} {'engine (ms)':>12} {'speedup':>9}")
+    for n in sizes:
+        df = with_metrics(synthetic(n))
+        t_build, comps = best_of(lambda: CompsEngine(df, FilterEngine(df).index), repeat=1)
+        mask = FilterEngine(df).mask(SELECTED)
+
+        t_pandas, expected = best_of(lambda: pandas_stats(df, mask, "micros"), repeat=1)
+        t_engine, got = best_of(lambda: comps.stats("micros", mask))
+        got = got.loc[expected.index, expected.columns]
+        assert np.allclose(got.to_numpy(float), expected.to_numpy(float), equal_nan=True)
+        print(
+            f"{n:>10,} {t_pandas * 1e3:>12.1f} {t_build * 1e3:>12.1f} "
+            f"{t_engine * 1e3:>12.2f} {t_pandas / t_engine:>8.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or SIZES)
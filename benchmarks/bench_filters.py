@@ -0,0 +1,81 @@
+# Filter latency of the buyers tab: per-row apply lambdas vs filters.FilterEngine.
+#
+#   python benchmarks/bench_filters.py [rows ...]
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from filters import FilterEngine  # noqa: E402
+
+SIZES = (10_000, 100_000, 1_000_000)
+SELECTED = {
+    "macros": ["macro_1", "macro_3"],
+    "micros": ["micro_7", "micro_11", "micro_20"],
+    "country": ["country_2"],
+}
+
+
+def synthetic(n, seed=0):
+    rng = np.random.default_rng(seed)
+
+    def lists(prefix, vocab, max_len):
+        lens = rng.integers(0, max_len + 1, n)
+        codes = rng.integers(0, vocab, lens.sum())
+        labels = np.array([f"{prefix}_{i}" for i in range(vocab)], dtype=object)[codes]
+        return np.split(labels, np.cumsum(lens)[:-1])
+
+    return pd.DataFrame(
+        {
+            "macros": [list(v) for v in lists("macro", 12, 2)],
+            "micros": [list(v) for v in lists("micro", 150, 4)],
+            "country": [f"country_{i}" for i in rng.integers(0, 60, n)],
+            "ciq_industry": [list(v) for v in lists("industry", 40, 1)],
+            "ciq_industry_category": [list(v) for v in lists("category", 300, 5)],
+        }
+    )
+
+
+def apply_mask(df, selected):
+    # The previous implementation in views/buyers.render
+    to_set = (
+        lambda v: (
+            set(map(lambda x: str(x).strip(), v))
+            if isinstance(v, list)
+            else ({str(v).strip()} if pd.notna(v) else set())
+        )
+    )
+    mask = pd.Series(True, index=df.index)
+    for col, labels in selected.items():
+        mask &= df[col].apply(lambda v: bool(to_set(v) & set(map(str, labels))))
+    return mask.to_numpy()
+
+
+def best_of(fn, repeat=5):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), out
+
+
+def main(sizes):
+    print(f"{'rows':>10} {'apply (ms)':>12} {'build (ms)':>12} {'engine (ms)':>12} {'speedup':>9}")
+    for n in sizes:
+        df = synthetic(n)
+        t_apply, expected = best_of(lambda: apply_mask(df, SELECTED), repeat=1 if n >= 1_000_000 else 3)
+        t_build, engine = best_of(lambda: FilterEngine(df), repeat=1)
+        t_engine, got = best_of(lambda: engine.mask(SELECTED))
+        assert np.array_equal(got, expected)
+        print(
+            f"{n:>10,} {t_apply * 1e3:>12.1f} {t_build * 1e3:>12.1f} "
+            f"{t_engine * 1e3:>12.2f} {t_apply / t_engine:>8.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or SIZES)
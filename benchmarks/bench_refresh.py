@@ -0,0 +1,121 @@
+# Cost of a change-feed poll (data.refresh) on the cached buyers table, against
+# an in-memory stand-in for PostgREST. An idle poll must keep the cached version,
+# or every view and derived index of that table is rebuilt on each tick.
+#
+#   python benchmarks/bench_refresh.py [rows ...]
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import data  # noqa: E402
+
+SIZES = (10_000, 100_000)
+COLUMNS = ("id", "entity", "micros")
+POLLS = 5
+
+
+class _Query:
+    # The subset of the postgrest query builder data.py uses
+    def __init__(self, rows):
+        self.rows, self.count, self.order_col, self.bounds = rows, None, None, None
+
+    def select(self, columns, count=None):
+        self.columns = None if columns == "*" else columns.split(",")
+        self.count = count
+        return self
+
+    def _where(self, keep):
+        self.rows = [r for r in self.rows if keep(r)]
+        return self
+
+    def in_(self, col, values):
+        return self._where(lambda r: r.get(col) in values)
+
+    def ov(self, col, values):
+        return self._where(lambda r: bool(set(r.get(col) or ()) & set(values)))
+
+    def gte(self, col, value):
+        return self._where(lambda r: r[col] >= value)
+
+    def gt(self, col, value):
+        return self._where(lambda r: r[col] > value)
+
+    def lt(self, col, value):
+        return self._where(lambda r: r[col] < value)
+
+    def order(self, col):
+        self.order_col = col
+        return self
+
+    def limit(self, n):
+        self.bounds = (0, n)
+        return self
+
+    def range(self, lo, hi):
+        self.bounds = (lo, hi + 1)
+        return self
+
+    def execute(self):
+        rows = sorted(self.rows, key=lambda r: r[self.order_col]) if self.order_col else self.rows
+        total = len(rows)
+        if self.bounds:
+            rows = rows[slice(*self.bounds)]
+        if self.columns:
+            rows = [{c: r.get(c) for c in self.columns} for r in rows]
+        return type("Result", (), {"data": rows, "count": total if self.count else None})
+
+
+class Conn:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def table(self, name):
+        return _Query(self.tables.get(name, []))
+
+
+def _stamp(seconds):
+    return (pd.Timestamp("2026-01-01", tz="UTC") + pd.Timedelta(seconds=seconds)).isoformat()
+
+
+def synthetic(n):
+    # Recent edits: the last rows share the newest updated_at values, so they
+    # fall inside WATERMARK_LAG and are read again by every poll
+    return [
+        {"id": i, "entity": f"entity {i}", "micros": [f"micro_{i % 150}"], "updated_at": _stamp(i // 100)}
+        for i in range(1, n + 1)
+    ]
+
+
+def poll(conn):
+    t0 = time.perf_counter()
+    data.refresh(conn)
+    return time.perf_counter() - t0, data.version("buyers_table", COLUMNS)
+
+
+def main(sizes):
+    print(f"{'rows':>10} {'idle poll (ms)':>15} {'change poll (ms)':>17}")
+    for n in sizes:
+        data._store.clear()  # start each size from an empty cache
+        rows = synthetic(n)
+        conn = Conn({"buyers_table": rows, "deleted_rows": []})
+        data.load(conn, "buyers_table", COLUMNS)
+        version = data.version("buyers_table", COLUMNS)
+
+        idle = []
+        for _ in range(POLLS):
+            elapsed, current = poll(conn)
+            assert current == version, "an idle poll produced a new version"
+            idle.append(elapsed)
+
+        rows.append({"id": n + 1, "entity": "new", "micros": [], "updated_at": _stamp(n // 100)})
+        changed, current = poll(conn)
+        assert current != version, "a new row didn't produce a new version"
+        assert poll(conn)[1] == current, "the poll after a change produced a new version"
+        print(f"{n:>10,} {min(idle) * 1e3:>15.1f} {changed * 1e3:>17.1f}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or SIZES)
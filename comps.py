@@ -0,0 +1,237 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import data
+import filters
+
+# Trading-comps statistics of entities_context: multiples, margins and growth,
+# per peer group (micro, macro, country) or over the whole filtered set.
+METRIC_COLUMNS = (
+    "EV_Revenue_LTM",
+    "EV_Revenue_FWD",
+    "EV_EBITDA_LTM",
+    "EV_EBITDA_FWD",
+    "EBITDA_Margin_LTM",
+    "Gross_Margin_LTM",
+    "CAGR_Revenue_3Y",
+    "CAGR_Revenue_5Y",
+    "CAGR_EBITDA_3Y",
+    "CAGR_EBITDA_5Y",
+    "Net_Working_Capital_Revenue",
+    "Beta_5Y",
+)
+GROUP_COLUMNS = ("micros", "macros", "country")
+STATS = ("count", "mean", "median", "q1", "q3", "trimmed_mean")
+TRIM = 0.1  # share of values cut from each end for trimmed_mean
+
+
+class _Grouping:
+    # Entries (row, group) of one label column, pre-sorted per metric by
+    # (group, value) with missing values last in each group. A row subset keeps
+    # that order, so its statistics need no sort: just gathers and cumsums.
+    def __init__(self, rows, codes, labels, values, ranks):
+        # ranks[:, j]: position of each row when sorted by metric j (NaN last)
+        self.labels = labels
+        self.rows, self.groups, self.values = [], [], []
+        for j in range(values.shape[1]):
+            order = np.argsort(codes * len(ranks) + ranks[rows, j])
+            v = values[rows[order], j]
+            self.rows.append(rows[order])
+            self.groups.append(codes[order])
+            self.values.append(v)
+
+    def stats(self, j, keep=None):
+        # {stat: array over groups} for metric j, over rows where keep is true
+        v, g = self.values[j], self.groups[j]
+        ok = ~np.isnan(v)
+        if keep is not None:
+            ok &= keep[self.rows[j]]
+        v, g = v[ok], g[ok]
+
+        n = np.bincount(g, minlength=len(self.labels))
+        start = np.cumsum(n) - n
+        has = n > 0
+        last = start + np.maximum(n - 1, 0)
+        csum = np.concatenate(([0.0], np.cumsum(v)))
+
+        def quantile(q):
+            # Linear interpolation between closest ranks, as pandas / NumPy do
+            pos = start + (n - 1).clip(min=0) * q
+            lo = np.floor(pos).astype(np.int64).clip(max=last)
+            hi = np.ceil(pos).astype(np.int64).clip(max=last)
+            out = np.full(len(n), np.nan)
+            out[has] = v[lo[has]] + (v[hi[has]] - v[lo[has]]) * (pos[has] - lo[has])
+            return out
+
+        cut = np.floor(n * TRIM).astype(np.int64)
+        kept = n - 2 * cut
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = (csum[start + n] - csum[start]) / n
+            trimmed = (csum[start + n - cut] - csum[start + cut]) / kept
+        return {
+            "count": n,
+            "mean": mean,
+            "median": quantile(0.5),
+            "q1": quantile(0.25),
+            "q3": quantile(0.75),
+            "trimmed_mean": trimmed,
+        }
+
+
+class CompsEngine:
+    def __init__(self, df, index, metrics=METRIC_COLUMNS, groups=GROUP_COLUMNS):
+        # index: the filters.FilterEngine label indexes of the same frame
+        self.n = len(df)
+        self.metrics = [m for m in metrics if m in df.columns]
+        values = np.column_stack(
+            [pd.to_numeric(df[m], errors="coerce").to_numpy(dtype=float, na_value=np.nan) for m in self.metrics]
+        ) if self.metrics else np.empty((self.n, 0))
+        ranks = np.empty(values.shape, dtype=np.int64)
+        ranks[np.argsort(values, axis=0), np.arange(values.shape[1])] = np.arange(self.n)[:, None]
+
+        self.groupings = {
+            col: _Grouping(index[col].rows, index[col].entry_codes, index[col].labels, values, ranks)
+            for col in groups
+            if col in index
+        }
+        # The whole set as one group, for the headline numbers
+        self.overall = _Grouping(
+            np.arange(self.n), np.zeros(self.n, dtype=np.int64), np.array(["All"], dtype=object), values, ranks
+        )
+
+    def _table(self, grouping, rows):
+        cols = {}
+        for j, metric in enumerate(self.metrics):
+            for stat, out in grouping.stats(j, rows).items():
+                cols[(metric, stat)] = out
+        table = pd.DataFrame(cols, index=pd.Index(grouping.labels, name="label"))
+        table.columns = pd.MultiIndex.from_tuples(table.columns, names=["metric", "stat"])
+        return table
+
+    def stats(self, by, rows=None):
+        # One row per label of `by`, columns (metric, stat); rows: boolean row set
+        return self._table(self.groupings[by], rows)
+
+    def summary(self, rows=None):
+        # One row per metric, one column per stat, over the (filtered) set
+        table = self._table(self.overall, rows)
+        return table.iloc[0].unstack("stat").reindex(index=self.metrics, columns=list(STATS))
+
+
+def _build(df):
+    return CompsEngine(df, filters.engine(df).index)
+
+
+def engine(df):
+    return data.derived(_build, df)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def stats(version, _df, selected, by=None):
+    # Cached per data version, filter set and grouping; by=None gives summary()
+    rows = filters.engine(_df).mask(selected)
+    comps = engine(_df)
+    return comps.summary(rows) if by is None else comps.stats(by, rows)
+
+
+# ---------- Peer percentiles ----------
+
+def _percentiles(codes, values):
+    # Percentile rank of each entry within its group code, per metric column,
+    # as pandas rank(pct=True) (ties averaged); missing values stay NaN
+    out = np.full(values.shape, np.nan, dtype=np.float32)
+    for j in range(values.shape[1]):
+        v = values[:, j]
+        ok = np.flatnonzero(~np.isnan(v))
+        order = ok[np.lexsort((v[ok], codes[ok]))]
+        if not len(order):
+            continue
+        g, s = codes[order], v[order]
+        group_new = np.r_[True, g[1:] != g[:-1]]
+        tie_new = group_new | np.r_[True, s[1:] != s[:-1]]
+
+        group = np.cumsum(group_new) - 1
+        group_start = np.flatnonzero(group_new)
+        group_size = np.diff(np.r_[group_start, len(order)])
+        tie = np.cumsum(tie_new) - 1
+        tie_start = np.flatnonzero(tie_new)
+        tie_mid = tie_start + (np.diff(np.r_[tie_start, len(order)]) - 1) / 2
+
+        out[order, j] = (tie_mid[tie] - group_start[group] + 1) / group_size[group]
+    return out
+
+
+class PeerCube:
+    # Percentile of every entity on every metric within each of its peer groups
+    # (micro, macro, country): {column: {label: (hash, ids, float32 [ids x metrics])}}.
+    # Built from the previous cube of the same table, a group is only recomputed
+    # when its members or their metrics changed.
+    def __init__(self, df, index, previous=None, metrics=METRIC_COLUMNS, groups=GROUP_COLUMNS):
+        self.metrics = [m for m in metrics if m in df.columns]
+        ids = df["id"].astype(str).to_numpy()
+        values = np.column_stack(
+            [pd.to_numeric(df[m], errors="coerce").to_numpy(dtype=float, na_value=np.nan) for m in self.metrics]
+        ) if self.metrics else np.empty((len(df), 0))
+        row_hash = pd.util.hash_pandas_object(df[["id", *self.metrics]], index=False).to_numpy()
+
+        self.groups = {}
+        self.rebuilt = 0  # groups recomputed for this version
+        for col in groups:
+            if col not in index:
+                continue
+            idx = index[col]
+            old = previous.groups.get(col, {}) if previous is not None and previous.metrics == self.metrics else {}
+            # Order-free content hash of each group (uint64 sums wrap around)
+            hashes = np.add.reduceat(row_hash[idx.rows], idx.offsets[:-1]) if len(idx.labels) else []
+
+            cube = {}
+            stale = []
+            for code, (label, h) in enumerate(zip(idx.labels, hashes)):
+                hit = old.get(label)
+                if hit is not None and hit[0] == h:
+                    cube[label] = hit
+                else:
+                    stale.append(code)
+
+            if stale:
+                stale = np.asarray(stale)
+                entries = np.isin(idx.entry_codes, stale)
+                rows, codes = idx.rows[entries], idx.entry_codes[entries]
+                pct = _percentiles(codes, values[rows])
+                # Entries stay grouped by code, so each stale group is a slice
+                bounds = np.cumsum(idx.totals[stale])[:-1]
+                for code, r, p in zip(stale, np.split(rows, bounds), np.split(pct, bounds)):
+                    cube[idx.labels[code]] = (hashes[code], ids[r], p)
+                self.rebuilt += len(stale)
+            self.groups[col] = cube
+
+    def lookup(self, entity_id, col, label):
+        # (percentiles by metric, peer count) of an entity in one group, or None
+        hit = self.groups.get(col, {}).get(label)
+        if hit is None:
+            return None
+        _, ids, pct = hit
+        pos = np.flatnonzero(ids == str(entity_id))
+        if not len(pos):
+            return None
+        return dict(zip(self.metrics, pct[pos[0]].tolist())), len(ids)
+
+
+@st.cache_resource
+def _cubes():
+    # data key (table, columns, filters) -> PeerCube of its latest version
+    return {}
+
+
+def _cube(df):
+    cubes = _cubes()
+    key = df.attrs["version"][0]
+    cube = PeerCube(df, filters.engine(df).index, previous=cubes.get(key))
+    cubes[key] = cube
+    return cube
+
+
+def peers(df):
+    # Shared PeerCube of a loaded entities_context version
+    return data.derived(_cube, df)
@@ -0,0 +1,540 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+
+import uploads
+
+# Shared, process-wide table cache. Every session reads the same entry until it
+# expires (TTL) or a write invalidates the tables it touched.
+TTL = 300  # seconds
+
+# Cached frames are held once per process and never modified in place: a reload
+# or refresh replaces the entry with a new frame (and version). Sessions get
+# shallow views of them (Datasets); with Copy-on-Write, writing to a view or to
+# anything derived from it copies just the touched columns, never the shared frame.
+# Always on from pandas 3.
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# Base table written by the app -> cached tables that must be reloaded after a write.
+# buyers_table / entities_context / public are views over entities + the label links.
+DEPENDENTS = {
+    "entities": ("entities", "public", "entities_context", "buyers_table"),
+    "buyer_micro_context": ("entities_context", "buyers_table"),
+    "micros": ("micros", "entities_context", "buyers_table"),
+    "macros": ("macros", "entities_context", "buyers_table"),
+}
+
+
+# Display columns of the buyers tab
+BUYER_COLUMNS = (
+    "id",
+    "entity",
+    "website",
+    "ticker",
+    "macros",
+    "micros",
+    "intel",
+    "intel_date",
+    "country",
+    "description",
+    "ciq_industry",
+    "ciq_industry_category",
+)
+
+# Postgres array columns filter by overlap (any selected label); the rest by IN
+ARRAY_COLUMNS = ("macros", "micros", "ciq_industry", "ciq_industry_category")
+
+# Label columns normalized on load: lists (or single labels) of clean strings
+LABEL_COLUMNS = ("macros", "micros", "country", "ciq_industry", "ciq_industry_category")
+BLANK_LABELS = ("", "nan", "none", "null")
+
+MAX_ENTRIES = 64  # cached (table, columns, filters) results kept per process
+
+# Incremental refresh: tables exposing WATERMARK are refreshed by fetching only
+# rows changed since the last load, plus tombstones of deleted rows
+# (sql/incremental_sync.sql). Table -> base table its tombstones are kept for.
+WATERMARK = "updated_at"
+WATERMARK_LAG = 5  # seconds re-read before the watermark, for late commits
+FULL_RELOAD = 3600  # seconds; incremental tables are still reloaded in full this often
+INCREMENTAL = {
+    "entities": "entities",
+    "buyers_table": "entities",
+    "entities_context": "entities",
+    "public": "entities",
+}
+
+PAGE_SIZE = 1000  # PostgREST's default max-rows
+WORKERS = 4  # concurrent page requests for large results
+
+
+@st.cache_resource
+def _store():
+    return {
+        "lock": threading.Lock(),
+        "entries": {},  # (table, columns, filters) -> (loaded_at, DataFrame)
+        "locks": {},  # key -> lock, so concurrent misses fetch only once
+        "generation": {},  # table -> bumped on every invalidation
+        "no_watermark": set(),  # tables found not to expose WATERMARK
+        "no_refresh": set(),  # tables whose incremental refresh failed (e.g. no deleted_rows)
+        "recent": {},  # key -> {id: WATERMARK} of the rows a refresh re-reads
+        "derived": {},  # key -> (lock, {builder: (version, result)}), see derived()
+    }
+
+
+def _freeze(filters):
+    # {"country": ["BR"], "micros": []} -> (("country", ("BR",)),), hashable and order-free
+    return tuple(
+        sorted((col, tuple(sorted(map(str, vals)))) for col, vals in (filters or {}).items() if vals)
+    )
+
+
+def build_query(conn, table, columns="*", filters=(), count=None):
+    select = columns if isinstance(columns, str) else ",".join(columns)
+    query = conn.table(table).select(select, count=count)
+    for col, values in filters:
+        if col in ARRAY_COLUMNS:
+            query = query.ov(col, list(values))
+        else:
+            query = query.in_(col, list(values))
+    return query
+
+
+def _count(conn, table, filters):
+    res = build_query(conn, table, "id", filters, count="exact").limit(1).execute()
+    return res.count or 0
+
+
+def _boundary(conn, table, filters, offset):
+    # id of the row at `offset` in id order; splits the result into key ranges
+    res = build_query(conn, table, "id", filters).order("id").range(offset, offset).execute()
+    return res.data[0]["id"] if res.data else None
+
+
+def _scan(conn, table, select, filters, lo=None, hi=None, since=None, status=None):
+    # Keyset scan over id in [lo, hi). Each page starts after the last id seen, so a
+    # server max-rows below PAGE_SIZE just means more pages, never dropped rows.
+    # It runs until a page comes back empty, so rows inserted after the count are
+    # still read. since=(column, value) restricts it to rows with column >= value.
+    # status["truncated"] is set if the scan had to stop before the end.
+    last = None
+    while True:
+        query = build_query(conn, table, select, filters).order("id")
+        if since is not None:
+            query = query.gte(*since)
+        if last is not None:
+            query = query.gt("id", last)
+        elif lo is not None:
+            query = query.gte("id", lo)
+        if hi is not None:
+            query = query.lt("id", hi)
+        page = query.limit(PAGE_SIZE).execute().data or []
+        if not page:
+            return
+        if last is not None and page[-1]["id"] <= last:
+            # The server ignored the keyset filter; stop rather than loop forever
+            if status is not None:
+                status["truncated"] = True
+            return
+        last = page[-1]["id"]
+        yield page
+
+
+def _pages(conn, table, select, filters, total, status=None):
+    if total <= 2 * PAGE_SIZE or WORKERS < 2:
+        yield from _scan(conn, table, select, filters, status=status)
+        return
+
+    # Large result: find the id at every PAGE_SIZE offset, then scan the key
+    # ranges concurrently. Pages are handed back on this thread as they land.
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        offsets = range(PAGE_SIZE, total, PAGE_SIZE)
+        bounds = list(pool.map(lambda o: _boundary(conn, table, filters, o), offsets))
+        bounds = [None] + [b for b in bounds if b is not None] + [None]
+        futures = [
+            pool.submit(lambda lo=lo, hi=hi: list(_scan(conn, table, select, filters, lo, hi, status=status)))
+            for lo, hi in zip(bounds, bounds[1:])
+        ]
+        for future in as_completed(futures):
+            for page in future.result():
+                yield page
+
+
+def _frame(rows, columns):
+    if isinstance(columns, str):
+        return pd.DataFrame(rows)
+    # Keep the projected columns (and only those) even when no row matched
+    return pd.DataFrame(rows, columns=list(columns))
+
+
+def _select(columns, watermark=False):
+    # Keyset pagination needs id, and incremental refresh the watermark, even
+    # when the caller didn't ask for them
+    if isinstance(columns, str):
+        return columns
+    extra = ("id", WATERMARK) if watermark else ("id",)
+    return columns + tuple(c for c in extra if c not in columns)
+
+
+def _watermark(rows, previous=None):
+    marks = [r[WATERMARK] for r in rows if r.get(WATERMARK)]
+    if previous is not None:
+        marks.append(previous)
+    return max(marks, key=pd.Timestamp) if marks else None
+
+
+def _recent(rows, watermark, previous=None):
+    # {id: WATERMARK} of the rows within WATERMARK_LAG of the watermark, i.e.
+    # those the next refresh reads again, so it can tell which really changed
+    if watermark is None:
+        return {}
+    cutoff = pd.Timestamp(watermark) - pd.Timedelta(seconds=WATERMARK_LAG)
+    marks = dict(previous or {})
+    marks.update((str(r["id"]), r[WATERMARK]) for r in rows if r.get(WATERMARK))
+    return {i: m for i, m in marks.items() if pd.Timestamp(m) >= cutoff}
+
+
+def _fetch(conn, table, columns, filters, on_page=None, watermark=False, recent=None):
+    # recent: dict filled with _recent() of the rows when watermark is set
+    total = _count(conn, table, filters)
+
+    rows = []
+    status = {"truncated": False}
+    select = _select(columns, watermark)
+    for n, page in enumerate(_pages(conn, table, select, filters, total, status), start=1):
+        rows.extend(page)
+        # Re-render the partial frame on pages 1, 2, 4, 8... so streaming stays linear
+        if on_page is not None and n & (n - 1) == 0:
+            on_page(_frame(rows, columns), total)
+
+    if total > 2 * PAGE_SIZE:
+        rows.sort(key=lambda r: r["id"])
+    df = _frame(rows, columns)
+    # Rows inserted or deleted since the count make it stale; only a scan that
+    # stopped early means rows are missing
+    df.attrs["total"] = max(total, len(df))
+    df.attrs["truncated"] = status["truncated"]
+    if watermark:
+        df.attrs["watermark"] = _watermark(rows)
+        df.attrs["full_at"] = time.time()
+        if recent is not None:
+            recent.update(_recent(rows, df.attrs["watermark"]))
+    return df
+
+
+def _tombstones(conn, table, since):
+    rows = _scan(
+        conn,
+        "deleted_rows",
+        "id,row_id",
+        (("table_name", (INCREMENTAL[table],)),),
+        since=("deleted_at", since),
+    )
+    return {r["row_id"] for page in rows for r in page}
+
+
+def _refresh(conn, table, columns, df, recent):
+    # Merges rows changed since the frame's watermark into a copy of it; returns
+    # (frame, recent), the frame itself when nothing changed so its version
+    # stays the same
+    since = (pd.Timestamp(df.attrs["watermark"]) - pd.Timedelta(seconds=WATERMARK_LAG)).isoformat()
+    rows = [r for page in _scan(conn, table, _select(columns, True), (), since=(WATERMARK, since)) for r in page]
+    deleted = _tombstones(conn, table, since)
+    # The rows within WATERMARK_LAG are read again on every call: only new ones
+    # and those whose WATERMARK moved since they were last read changed
+    changed = [r for r in rows if recent.get(str(r["id"])) != r[WATERMARK]]
+    watermark = _watermark(changed, df.attrs["watermark"])
+    recent = _recent(rows, watermark, recent)
+    ids = df["id"].astype(str)
+    if not changed and not ids.isin(deleted).any():
+        return df, recent
+
+    changed_df = _frame(changed, columns)
+    drop = deleted | {str(r["id"]) for r in changed}
+    out = pd.concat(
+        [df[~ids.isin(drop)], changed_df], ignore_index=True
+    ).sort_values("id", ignore_index=True)
+    out.attrs["total"] = len(out)
+    out.attrs["truncated"] = False
+    out.attrs["watermark"] = watermark
+    out.attrs["full_at"] = df.attrs["full_at"]
+    return out, recent
+
+
+# ---------- Label columns ----------
+
+class LabelColumn:
+    # Dictionary-encoded list column, laid out like Arrow list<dictionary>: the
+    # labels of row i are labels[codes[offsets[i]:offsets[i + 1]]]. `scalar`
+    # columns hold at most one label per row (e.g. country).
+    def __init__(self, labels, codes, offsets, scalar=False):
+        self.labels = labels
+        self.codes = codes
+        self.offsets = offsets
+        self.scalar = scalar
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def row(self, i):
+        return self.labels[self.codes[self.offsets[i] : self.offsets[i + 1]]].tolist()
+
+    def values(self, rows=None):
+        # Python values of the given row positions (all by default), for the
+        # editors: lists, or a label / None for scalar columns
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        starts, sizes = self.offsets[rows], np.diff(self.offsets)[rows]
+        ends = np.cumsum(sizes)
+        entries = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - (ends - sizes), sizes)
+        flat = self.labels[self.codes[entries]].tolist()
+        bounds = zip((ends - sizes).tolist(), ends.tolist())
+        out = np.empty(len(rows), dtype=object)
+        if self.scalar:
+            out[:] = [flat[lo] if hi > lo else None for lo, hi in bounds]
+        else:
+            out[:] = [flat[lo:hi] for lo, hi in bounds]
+        return out
+
+    def series(self):
+        # Compact column for the shared frame: categorical codes for scalar
+        # columns, otherwise Arrow list<string> (what Streamlit sends lists as)
+        if self.scalar:
+            codes = np.full(len(self), -1, dtype=np.int32)
+            has = np.diff(self.offsets) > 0
+            codes[has] = self.codes[self.offsets[:-1][has]]
+            return pd.Categorical.from_codes(codes, categories=self.labels)
+        values = pa.array(self.labels, type=pa.string()).take(pa.array(self.codes))
+        lists = pa.ListArray.from_arrays(pa.array(self.offsets, type=pa.int32()), values)
+        return pd.arrays.ArrowExtensionArray(lists)
+
+
+def _encode(values):
+    s = pd.Series(values, dtype=object).reset_index(drop=True)
+    scalar = not s.map(lambda v: isinstance(v, (list, tuple, np.ndarray))).any()
+    labels = s.explode()
+    labels = labels[labels.notna()].astype(str).str.strip()
+    # Lists stored as text ("[a, 'b']") are split here, once
+    listed = labels.str.startswith("[") & labels.str.endswith("]")
+    if listed.any():
+        parts = labels[listed].str[1:-1].str.split(",").explode().str.strip(" '\"")
+        labels = pd.concat([labels[~listed], parts.dropna()]).sort_index(kind="stable")
+    labels = labels[~labels.str.lower().isin(BLANK_LABELS)]
+
+    codes, dictionary = pd.factorize(labels.to_numpy())
+    counts = np.bincount(labels.index.to_numpy(dtype=np.int64), minlength=len(s))
+    return LabelColumn(
+        np.asarray(dictionary, dtype=object),
+        codes.astype(np.int32),
+        np.concatenate(([0], np.cumsum(counts))),
+        scalar and bool((counts <= 1).all()),
+    )
+
+
+def encode_labels(df):
+    # {column: LabelColumn} of the label columns present in df
+    return {col: _encode(df[col].to_numpy()) for col in LABEL_COLUMNS if col in df.columns}
+
+
+def derived(build, df):
+    # build(df), computed once per loaded version of df and shared by every
+    # session; frames without a version (e.g. fetch results) are built each time.
+    # Only the latest version is kept per data key, so superseded frames (and
+    # the indexes over them) can be freed, like comps._cubes.
+    version = df.attrs.get("version")
+    if version is None:
+        return build(df)
+    key, name = version[0], f"{build.__module__}.{build.__qualname__}"
+    store = _store()
+    with store["lock"]:
+        # Re-entrant: a builder may use another one over the same frame
+        lock, built = store["derived"].setdefault(key, (threading.RLock(), {}))
+    with lock:
+        hit = built.get(name)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+        result = build(df)
+        # A session still on an older version doesn't displace the newer one
+        if hit is None or hit[0][2] <= version[2]:
+            built[name] = (version, result)
+        return result
+
+
+def labels(df):
+    # Encoded label columns of a frame, shared by filtering, the derived
+    # indexes and the editors
+    return derived(encode_labels, df)
+
+
+def _normalize(df):
+    # Replaces the Python lists of a newly loaded frame's label columns with
+    # their compact form; the encoding itself is kept for the derived indexes
+    for col, column in labels(df).items():
+        df[col] = column.series()
+
+
+def fetch(conn, table, columns="*", filters=None):
+    # Uncached paginated read, for callers that must see the current rows
+    columns = columns if isinstance(columns, str) else tuple(columns)
+    return _fetch(conn, table, columns, _freeze(filters))
+
+
+def load(conn, table, columns="*", filters=None, on_page=None):
+    # on_page(partial_df, total) is called as pages arrive on a cache miss
+    columns = columns if isinstance(columns, str) else tuple(columns)
+    key = (table, columns, _freeze(filters))
+
+    store = _store()
+    with store["lock"]:
+        key_lock = store["locks"].setdefault(key, threading.Lock())
+
+    with key_lock:
+        hit = store["entries"].get(key)
+        if hit and time.time() - hit[0] < TTL:
+            return hit[1]
+
+        gen = store["generation"].get(table, 0)
+        loaded_at = time.time()
+        incremental = (
+            table in INCREMENTAL
+            and not key[2]
+            and table not in store["no_watermark"]
+            and table not in store["no_refresh"]
+            and (isinstance(columns, str) or "id" in columns)
+        )
+
+        df = None
+        recent = {}
+        if (
+            hit
+            and incremental
+            and hit[1].attrs.get("watermark")
+            and loaded_at - hit[1].attrs["full_at"] < FULL_RELOAD
+        ):
+            try:
+                df, recent = _refresh(conn, table, columns, hit[1], store["recent"].get(key, {}))
+            except Exception as e:
+                # Fall back to a full reload; unless it was a blip (e.g. no
+                # deleted_rows table yet), stop refreshing this table incrementally
+                if not uploads.is_transient(e):
+                    store["no_refresh"].add(table)
+                    incremental = False
+                df = None
+        if df is None:
+            try:
+                df = _fetch(conn, table, columns, key[2], on_page, watermark=incremental, recent=recent)
+            except Exception as e:
+                # 42703: undefined column, i.e. the table has no WATERMARK yet
+                if not incremental or str(getattr(e, "code", "")) != "42703":
+                    raise
+                store["no_watermark"].add(table)
+                df = _fetch(conn, table, columns, key[2], on_page)
+        if hit is None or df is not hit[1]:
+            # Cheap token for caches derived from this frame (filter indexes, labels...)
+            df.attrs["version"] = (key, gen, loaded_at)
+            _normalize(df)
+
+        with store["lock"]:
+            # Don't cache a result that was invalidated while it was in flight
+            if store["generation"].get(table, 0) == gen:
+                store["entries"][key] = (loaded_at, df)
+                if df.attrs.get("watermark"):
+                    store["recent"][key] = recent
+                else:
+                    store["recent"].pop(key, None)
+                _evict(store)
+        return df
+
+
+def refresh(conn):
+    # Pulls changes into every cached incremental entry now (used by the change feed)
+    store = _store()
+    with store["lock"]:
+        keys = [k for k, (_, df) in store["entries"].items() if df.attrs.get("watermark")]
+        for key in keys:
+            store["entries"][key] = (0, store["entries"][key][1])
+    for table, columns, _ in keys:
+        load(conn, table, columns)
+
+
+def version(table, columns="*", filters=None):
+    # Version token of the cached result, or None when it isn't cached
+    columns = columns if isinstance(columns, str) else tuple(columns)
+    entry = _store()["entries"].get((table, columns, _freeze(filters)))
+    return entry[1].attrs.get("version") if entry else None
+
+
+def _evict(store):
+    # Drop expired results first (but keep those that can be refreshed
+    # incrementally), then the oldest ones, to bound memory
+    entries = store["entries"]
+    now = time.time()
+    for key in [
+        k for k, (ts, df) in entries.items()
+        if now - ts >= TTL and not df.attrs.get("watermark")
+    ]:
+        entries.pop(key)
+        store["locks"].pop(key, None)
+        store["recent"].pop(key, None)
+        store["derived"].pop(key, None)
+    while len(entries) > MAX_ENTRIES:
+        oldest = min(entries, key=lambda k: entries[k][0])
+        entries.pop(oldest)
+        store["locks"].pop(oldest, None)
+        store["recent"].pop(oldest, None)
+        store["derived"].pop(oldest, None)
+    # ... and what was derived from results no longer cached
+    for key in [k for k in store["derived"] if k not in entries]:
+        store["derived"].pop(key)
+
+
+def invalidate(*tables):
+    store = _store()
+    with store["lock"]:
+        stale = {dep for table in tables for dep in DEPENDENTS.get(table, (table,))}
+        for key in [k for k in store["entries"] if k[0] in stale]:
+            df = store["entries"][key][1]
+            if df.attrs.get("watermark"):
+                # Keep it as the base of an incremental refresh on next read
+                store["entries"][key] = (0, df)
+            else:
+                store["entries"].pop(key)
+                store["recent"].pop(key, None)
+                store["derived"].pop(key, None)
+        for dep in stale:
+            store["generation"][dep] = store["generation"].get(dep, 0) + 1
+
+
+def _view(df):
+    # New frame object over the same column buffers (no data copied), so a
+    # session can't add or replace columns of the shared one
+    return df.copy(deep=False)
+
+
+class Datasets:
+    # Lazy per-run view over the shared cache. Each tab declares the tables it
+    # reads; a table is only fetched the first time the tab actually reads it.
+    def __init__(self, conn, tables):
+        self._conn = conn
+        self._tables = tuple(tables)
+        self._loaded = {}
+
+    def __contains__(self, table):
+        return table in self._tables
+
+    def __getitem__(self, table):
+        if table not in self._tables:
+            raise KeyError(f"Table {table!r} is not declared for this tab.")
+        if table not in self._loaded:
+            self._loaded[table] = _view(load(self._conn, table))
+        return self._loaded[table]
+
+    def query(self, table, columns="*", filters=None, on_page=None):
+        # Projected / filtered read, resolved server-side and cached per filter set
+        if table not in self._tables:
+            raise KeyError(f"Table {table!r} is not declared for this tab.")
+        return _view(load(self._conn, table, columns, filters, on_page))
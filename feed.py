@@ -0,0 +1,83 @@
+import asyncio
+import threading
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import data
+
+# Optional change feed keeping the shared cached tables current, enabled with
+# the secret CHANGE_FEED = true (off by default, as it polls for the life of
+# the process whether or not any session is connected). A background thread
+# pulls changes into every incremental cache entry (data.refresh), which only
+# fetches rows changed since the last watermark plus tombstones. With
+# Supabase realtime enabled (secret REALTIME = true), change events for
+# FEED_TABLES wake it immediately; otherwise it polls, which also works against
+# a plain local Postgres + PostgREST.
+FEED_TABLES = ("entities", "buyer_micro_context")
+POLL_INTERVAL = 5  # seconds between polls without realtime
+REALTIME_INTERVAL = 60  # safety poll when realtime events drive refreshes
+
+
+def _listen(url, key, wake, ready):
+    # Runs the realtime client on its own event loop; any event is a wake-up
+    async def main():
+        from supabase import acreate_client
+
+        client = await acreate_client(url, key)
+        channel = client.channel("igc-changes")
+        for table in FEED_TABLES:
+            channel.on_postgres_changes(
+                "*", schema="public", table=table, callback=lambda payload: wake.set()
+            )
+        await channel.subscribe()
+        ready.set()
+        while True:
+            await asyncio.sleep(3600)
+
+    try:
+        asyncio.run(main())
+    except Exception:
+        pass  # polling keeps the cache current
+
+
+def _worker(conn, wake, realtime, ctx):
+    add_script_run_ctx(threading.current_thread(), ctx)
+    while True:
+        wake.wait(REALTIME_INTERVAL if realtime.is_set() else POLL_INTERVAL)
+        wake.clear()
+        try:
+            data.refresh(conn)
+        except Exception:
+            pass  # the next tick retries; reads fall back to normal loads
+
+
+def enabled():
+    return bool(st.secrets.get("CHANGE_FEED", False))
+
+
+@st.cache_resource
+def start(_conn):
+    # One feed per process, started by the first session that asks for it
+    wake, realtime = threading.Event(), threading.Event()
+    ctx = get_script_run_ctx()
+    if st.secrets.get("REALTIME", False):
+        threading.Thread(
+            target=_listen,
+            args=(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"], wake, realtime),
+            name="feed-realtime",
+            daemon=True,
+        ).start()
+    threading.Thread(
+        target=_worker, args=(_conn, wake, realtime, ctx), name="feed-refresh", daemon=True
+    ).start()
+    return {"wake": wake, "realtime": realtime}
+
+
+def watch(table, columns, version, interval=POLL_INTERVAL):
+    # Reruns the page when the shared cached copy moves past `version`
+    def _check():
+        if data.version(table, columns) not in (None, version):
+            st.rerun()
+
+    st.fragment(_check, run_every=interval)()
@@ -0,0 +1,77 @@
+import numpy as np
+
+import data
+
+# List-valued (or scalar) label columns the buyers tab filters on
+LABEL_COLUMNS = data.LABEL_COLUMNS
+
+
+class LabelIndex:
+    # Label membership of one encoded column (data.LabelColumn), transposed:
+    # for label code c, the rows carrying it are rows[offsets[c]:offsets[c + 1]]
+    # (a CSC-style sparse matrix).
+    def __init__(self, column):
+        self.n = len(column)
+        order = np.argsort(column.codes, kind="stable")
+
+        self.labels = column.labels
+        self.codes = {label: code for code, label in enumerate(self.labels)}
+        self.rows = np.repeat(np.arange(self.n), np.diff(column.offsets))[order]
+        self.totals = np.bincount(column.codes, minlength=len(self.labels))
+        self.offsets = np.concatenate(([0], np.cumsum(self.totals)))
+        # Label code of every entry in `rows`, for counting within a row set
+        self.entry_codes = np.repeat(np.arange(len(self.labels)), self.totals)
+
+    def mask(self, selected):
+        # Rows carrying any of the selected labels
+        out = np.zeros(self.n, dtype=bool)
+        for label in selected:
+            code = self.codes.get(str(label))
+            if code is not None:
+                out[self.rows[self.offsets[code] : self.offsets[code + 1]]] = True
+        return out
+
+
+    def counts(self, rows=None):
+        # Rows carrying each label, optionally restricted to a boolean row set
+        if rows is None:
+            return self.totals
+        return np.bincount(self.entry_codes[rows[self.rows]], minlength=len(self.labels))
+
+
+class FilterEngine:
+    def __init__(self, df, columns=LABEL_COLUMNS):
+        self.n = len(df)
+        encoded = data.labels(df)
+        self.index = {col: LabelIndex(encoded[col]) for col in columns if col in encoded}
+
+    def labels(self, col):
+        # Distinct labels of a column, in order of first appearance
+        return self.index[col].labels.tolist() if col in self.index else []
+
+    def mask(self, selected):
+        # selected: {column: [labels]}; empty selections don't filter
+        out = np.ones(self.n, dtype=bool)
+        for col, labels in selected.items():
+            if labels and col in self.index:
+                out &= self.index[col].mask(labels)
+        return out
+
+    def facet_counts(self, selected):
+        # {column: {label: count}}. Each column is counted over the rows matching
+        # every *other* filter, so its counts show what picking an option would add.
+        masks = {
+            col: self.index[col].mask(labels)
+            for col, labels in selected.items()
+            if labels and col in self.index
+        }
+        out = {}
+        for col, index in self.index.items():
+            others = [m for c, m in masks.items() if c != col]
+            rows = np.logical_and.reduce(others) if others else None
+            out[col] = dict(zip(index.labels, index.counts(rows).tolist()))
+        return out
+
+
+def engine(df):
+    return data.derived(FilterEngine, df)
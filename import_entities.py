@@ -1,10 +1,200 @@
+import codecs
+import hashlib
+import importlib.util
+import numpy as np
 import pandas as pd
 import streamlit as st
+from collections import OrderedDict
 from io import BytesIO
 
-def chunk_list(lst, size):
-    for i in range(0, len(lst), size):
-        yield lst[i : i + size]
+import data
+import jobs
+import uploads
+
+REQUIRED_COLUMNS = ("entity", "mi_key", "ticker")
+OPTIONAL_COLUMNS = ("website", "description", "country", "city", "industry", "all_industries")
+ENTITY_COLUMNS = REQUIRED_COLUMNS + OPTIONAL_COLUMNS
+
+CHUNK_ROWS = 50_000  # CSV rows parsed at a time
+PREVIEW_ROWS = 5  # rows parsed for the preview before the full read
+EXCEL_SHEET = "ciq"
+BATCH_SIZE = 500  # rows per upsert request
+UPLOAD_CACHE_BYTES = 256 * 1024 * 1024  # parsed uploads kept per session
+
+# ---------- Column-wise ingestion ----------
+
+def _csv_encoding(raw, block=1 << 20):
+    # Validate UTF-8 incrementally instead of decoding the whole upload at once
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    try:
+        for i in range(0, len(raw), block):
+            decoder.decode(raw[i : i + block])
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return "latin1"
+    return "utf-8-sig"
+
+
+def _wanted(col):
+    # Only the entities columns are parsed; the rest of a CIQ export is skipped
+    return str(col).strip().lower() in ENTITY_COLUMNS
+
+
+def _excel_engine():
+    # calamine (Rust) is much faster than openpyxl and only parses the sheet
+    # asked for; fall back to pandas' per-extension default when missing.
+    return "calamine" if importlib.util.find_spec("python_calamine") else None
+
+
+def _read_excel(raw, nrows=None, chunksize=None):
+    return [
+        pd.read_excel(
+            BytesIO(raw),
+            sheet_name=EXCEL_SHEET,
+            header=0,
+            usecols=_wanted,
+            nrows=nrows,
+            engine=_excel_engine(),
+        )
+    ]
+
+
+def _read_csv(raw, nrows=None, chunksize=CHUNK_ROWS):
+    return pd.read_csv(
+        BytesIO(raw),
+        encoding=_csv_encoding(raw),
+        usecols=_wanted,
+        nrows=nrows,
+        chunksize=chunksize,
+    )
+
+
+# File extension -> reader(raw, nrows, chunksize) returning an iterable of DataFrames
+READERS = {
+    ".csv": _read_csv,
+    ".xlsx": _read_excel,
+    ".xls": _read_excel,
+    ".xlsm": _read_excel,
+}
+
+
+def read_chunks(name, raw, nrows=None, chunksize=CHUNK_ROWS):
+    # Yields the upload as DataFrames with normalized (stripped, lower-case) headers
+    ext = name[name.rfind(".") :].lower()
+    reader = READERS.get(ext, _read_csv)
+    for chunk in reader(raw, nrows=nrows, chunksize=chunksize):
+        chunk.columns = [str(c).strip().lower() for c in chunk.columns]
+        yield chunk
+
+
+def _text(col):
+    # Stripped text, with blanks as nulls
+    col = col.astype("string").str.strip()
+    return col.mask(col == "")
+
+
+def normalize(df):
+    # Coerce one chunk to the entities schema, dropping rows missing a required field
+    mi_key = pd.to_numeric(df["mi_key"], errors="coerce").astype("float64")
+    mi_key = np.trunc(mi_key.where(np.isfinite(mi_key)))
+
+    out = pd.DataFrame(
+        {
+            "entity": _text(df["entity"]),
+            "mi_key": mi_key.astype("Int64"),
+            "ticker": _text(df["ticker"]),
+        }
+    )
+    for col in OPTIONAL_COLUMNS:
+        if col in df.columns:
+            out[col] = _text(df[col])
+        else:
+            out[col] = pd.Series(pd.NA, index=df.index, dtype="string")
+    return out.dropna(subset=list(REQUIRED_COLUMNS))
+
+
+def prepare(chunks):
+    # Normalized, de-duplicated rows of the whole upload (last row per mi_key wins)
+    parts = [normalize(chunk) for chunk in chunks]
+    if not parts:
+        return pd.DataFrame(columns=list(ENTITY_COLUMNS))
+    df = pd.concat(parts, ignore_index=True)
+    return df.drop_duplicates(subset=["mi_key"], keep="last").reset_index(drop=True)
+
+
+def upsert_batches(df, size=BATCH_SIZE):
+    # JSON-ready row dicts straight from the column buffers (nulls as None)
+    keys = list(df.columns)
+    cols = [df[c].astype(object).where(df[c].notna(), None).to_numpy() for c in keys]
+    for start in range(0, len(df), size):
+        values = [col[start : start + size].tolist() for col in cols]
+        yield [dict(zip(keys, row)) for row in zip(*values)]
+
+
+# ---------- Delta import ----------
+
+def row_hashes(df):
+    # 64-bit content hash per normalized row; equal rows hash equal on both sides
+    return pd.util.hash_pandas_object(df[list(ENTITY_COLUMNS)], index=False).to_numpy()
+
+
+def split_delta(conn, df_rows):
+    # Compares the upload with the entities already stored, by mi_key and row hash.
+    # Returns (rows to upsert, {"inserted": n, "updated": n, "unchanged": n}).
+    existing = normalize(data.fetch(conn, "entities", ENTITY_COLUMNS))
+    existing = existing.drop_duplicates(subset=["mi_key"], keep="last")
+
+    pos = pd.Index(existing["mi_key"]).get_indexer(df_rows["mi_key"])
+    known = pos >= 0
+    unchanged = np.zeros(len(df_rows), dtype=bool)
+    unchanged[known] = row_hashes(existing)[pos[known]] == row_hashes(df_rows)[known]
+
+    summary = {
+        "inserted": int((~known).sum()),
+        "updated": int((known & ~unchanged).sum()),
+        "unchanged": int(unchanged.sum()),
+    }
+    return df_rows[~unchanged].reset_index(drop=True), summary
+
+
+# ---------- Parse cache ----------
+
+def _upload_cache():
+    # sha256 of the upload -> {"preview", "error", "rows"}, least recently used first
+    return st.session_state.setdefault("upload_cache", OrderedDict())
+
+
+def _frame_bytes(df):
+    return int(df.memory_usage(deep=True).sum()) if df is not None else 0
+
+
+def _evict(cache, keep):
+    # Drop least recently used parses until the session is under its memory bound
+    while len(cache) > 1:
+        used = sum(_frame_bytes(e["preview"]) + _frame_bytes(e["rows"]) for e in cache.values())
+        oldest = next(iter(cache))
+        if used <= UPLOAD_CACHE_BYTES or oldest == keep:
+            return
+        cache.pop(oldest)
+
+
+def cached_upload(uploaded_file):
+    # Cache entry of an upload. The digest is computed once per uploader file_id,
+    # so reruns neither re-read nor re-hash the bytes.
+    digests = st.session_state.setdefault("upload_digests", {})
+    digest = digests.get(uploaded_file.file_id)
+    if digest is None:
+        digest = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+        digests[uploaded_file.file_id] = digest
+
+    cache = _upload_cache()
+    if digest not in cache:
+        cache[digest] = {"digest": digest, "preview": None, "error": None, "rows": None}
+    cache.move_to_end(digest)
+    return cache[digest]
+
+
+# ---------- Upload UI ----------
 
 def buyers_file(conn):
     uploaded_file = st.file_uploader(
@@ -13,35 +203,35 @@ def buyers_file(conn):
         key="buyers_file",
     )
 
+    # Imports keep running in the background; show them even with no file selected
+    _show_import_jobs()
+
     if not uploaded_file:
         return
 
-    # --- 1) Read file ONCE ---
+    # --- 1) Parse each distinct upload ONCE per session ---
     name = uploaded_file.name.lower()
-    raw = uploaded_file.read()
+    entry = cached_upload(uploaded_file)
 
-    try:
-        if name.endswith((".xlsx", ".xls", ".xlsm")):
-            # 👇 THIS is the important part
-            df = pd.read_excel(BytesIO(raw), sheet_name="ciq", header=0)
-        else:
-            try:
-                df = pd.read_csv(BytesIO(raw), encoding="utf-8-sig")
-            except UnicodeDecodeError:
-                df = pd.read_csv(BytesIO(raw), encoding="latin1")
-    except Exception as e:
-        st.error(f"Could not read file: {e}")
-        return
+    if entry["preview"] is None and entry["error"] is None:
+        try:
+            # Only the first rows are parsed for the preview and the column check
+            entry["preview"] = next(
+                read_chunks(name, uploaded_file.getvalue(), nrows=PREVIEW_ROWS),
+                pd.DataFrame(),
+            )
+        except Exception as e:
+            entry["error"] = str(e)
 
-    st.write("Columns as seen by pandas (raw):", df.columns.tolist())
-    st.dataframe(df.head())
+    if entry["error"] is not None:
+        st.error(f"Could not read file: {entry['error']}")
+        return
+    df = entry["preview"]
 
-    # --- 2) Normalize column names ---
-    df.columns = [str(c).strip().lower() for c in df.columns]
+    # --- 2) Normalized column names ---
     st.write("Normalized columns:", df.columns.tolist())
 
-    required_cols = ["entity", "mi_key", "ticker"]
-    missing = [c for c in required_cols if c not in df.columns]
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
     if missing:
         st.error(f"Missing required columns in file: {', '.join(missing)}")
         return
@@ -49,67 +239,136 @@ def buyers_file(conn):
     st.write("Preview of uploaded data:")
     st.dataframe(df.head())
 
+    delta_only = st.checkbox(
+        "Only send new or changed rows",
+        value=True,
+        key="buyers_file_delta",
+        help="Skips entities whose data is identical to what is already stored.",
+    )
+
     # --- 3) Import button ---
     if st.button("Import into Supabase", type="primary", use_container_width=True):
-        rows = []
-        for _, r in df.iterrows():
-            entity = str(r["entity"]).strip() if pd.notna(r["entity"]) else None
-            ticker = str(r["ticker"]).strip() if pd.notna(r["ticker"]) else None
-
-            mi_val = r["mi_key"]
-            if pd.isna(mi_val):
-                mi_key = None
-            else:
-                try:
-                    mi_key = int(float(mi_val))
-                except Exception:
-                    mi_key = None
-
-            if not entity or mi_key is None or not ticker:
-                continue
-
-            row_data = {
-                "entity": entity,
-                "mi_key": mi_key,
-                "ticker": ticker,
-                "website": str(r.get("website") or "").strip() or None,
-                "description": str(r.get("description") or "").strip() or None,
-                "country": str(r.get("country") or "").strip() or None,
-                "city": str(r.get("city") or "").strip() or None,
-                "industry": str(r.get("industry") or "").strip() or None,
-                "all_industries": str(r.get("all_industries") or "").strip() or None,
-            }
-            rows.append(row_data)
-
-        if not rows:
+        if entry["rows"] is None:
+            try:
+                entry["rows"] = prepare(read_chunks(name, uploaded_file.getvalue()))
+            except Exception as e:
+                st.error(f"Could not read file: {e}")
+                return
+            _evict(_upload_cache(), keep=entry["digest"])
+        df_rows = entry["rows"]
+
+        if df_rows.empty:
             st.warning("No valid rows to insert.")
             return
 
-        df_rows = pd.DataFrame(rows).drop_duplicates(subset=["mi_key"], keep="last")
-        rows = df_rows.to_dict(orient="records")
-
-        st.write("Number of rows after deduplication:", len(rows))
-
-        errors = []
-        inserted_total = 0
-
-        with st.spinner("Importing data into Supabase..."):
-            for batch in chunk_list(rows, 500):
-                try:
-                    res = (
-                        conn.table("entities")
-                        .upsert(batch, on_conflict="mi_key")
-                        .execute()
-                    )
-                    inserted_total += len(res.data or [])
-                except Exception as e:
-                    errors.append(str(e))
-
-        if errors:
-            st.error("Some errors occurred during import:")
-            for e in errors:
-                st.write(f"- {e}")
-        else:
+        st.write("Number of rows after deduplication:", len(df_rows))
+
+        # The upload runs as a background job: reruns, other users and a
+        # browser refresh don't block or interrupt it.
+        jobs.submit(
+            f"Import {uploaded_file.name}",
+            _import_job,
+            conn,
+            df_rows,
+            delta_only,
+            owner=_owner(),
+        )
+        st.rerun()
+
+
+# ---------- Background import ----------
+
+def _owner():
+    # Jobs are listed per signed-in user, so they survive a browser refresh
+    session = st.session_state.get("session")
+    user = getattr(session, "user", None)
+    return getattr(user, "email", None)
+
+
+def _import_job(job, conn, df_rows, delta_only):
+    summary = None
+    if delta_only:
+        df_rows, summary = split_delta(conn, df_rows)
+
+    report = uploads.upload(
+        conn,
+        "entities",
+        upsert_batches(df_rows),
+        key="mi_key",
+        total=len(df_rows),
+        on_progress=lambda done, total, rate: jobs.progress(job, done, total, rate),
+        should_stop=job["cancel"].is_set,
+    )
+    if report["written"]:
+        data.invalidate("entities")
+    if report["error"]:
+        raise RuntimeError(
+            f"{report['error']} ({report['written']} entities imported, {report['skipped']} rows not sent)"
+        )
+    report["summary"] = summary
+    return report
+
+
+def _show_import_jobs():
+    owned = jobs.list_jobs(_owner())
+    if not owned:
+        return
+    # Poll only while something is queued or running
+    active = any(j["status"] in jobs.ACTIVE for j in owned)
+    st.fragment(_import_jobs_panel, run_every=1.0 if active else None)()
+
+
+def _import_jobs_panel():
+    seen = st.session_state.setdefault("import_jobs_seen", set())
+    refresh = False
+
+    for job in jobs.list_jobs(_owner()):
+        status = job["status"]
+        if status in jobs.ACTIVE:
+            total = job["total"] or 0
+            cols = st.columns((4, 1))
+            with cols[0]:
+                st.progress(
+                    job["done"] / total if total else 0.0,
+                    text=(
+                        f"{job['label']}: {job['done']:,} / {total:,} rows · {job['rate']:,.0f} rows/s"
+                        if total
+                        else f"{job['label']}: {status}…"
+                    ),
+                )
+            with cols[1]:
+                if st.button("Cancel", key=f"cancel_{job['id']}", disabled=job["cancel"].is_set()):
+                    jobs.cancel(job["id"])
+            continue
+
+        if job["id"] not in seen:
+            # Reload the page once so the tables pick up the imported rows
+            seen.add(job["id"])
+            refresh = True
+
+        report = job["result"] or {}
+        summary = report.get("summary")
+        written = report.get("written", 0)
+        if status == "failed":
+            st.error(f"{job['label']} failed: {job['error']}")
+        elif status == "cancelled":
+            st.warning(
+                f"{job['label']} cancelled: {written} entities imported, "
+                f"{report.get('skipped', 0)} rows not sent."
+            )
+        elif report.get("failed"):
+            st.error(f"{job['label']}: imported {written} entities; {len(report['failed'])} row(s) failed:")
+            st.dataframe(
+                pd.DataFrame(report["failed"], columns=["mi_key", "error"]),
+                hide_index=True,
+            )
+        elif summary:
             st.success(
-                f"Successfully imported (inserted/updated) {inserted_total} entities."
+                f"{job['label']}: {summary['inserted']} inserted, "
+                f"{summary['updated']} updated, {summary['unchanged']} unchanged."
             )
+        else:
+            st.success(f"{job['label']}: imported (inserted/updated) {written} entities.")
+
+    if refresh:
+        st.rerun(scope="app")
@@ -0,0 +1,97 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Process-wide background jobs (long imports). Jobs run on a small thread pool,
+# so a rerun or a browser refresh doesn't stop them; sessions poll the job table.
+MAX_WORKERS = 2
+KEEP_FINISHED = 3600  # seconds a finished job stays listed
+
+ACTIVE = ("queued", "running")
+
+
+@st.cache_resource
+def _runner():
+    return {
+        "pool": ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="job"),
+        "lock": threading.Lock(),
+        "jobs": {},  # id -> job dict
+    }
+
+
+def _prune(jobs):
+    now = time.time()
+    for job_id in [
+        j["id"] for j in jobs.values()
+        if j["finished_at"] and now - j["finished_at"] > KEEP_FINISHED
+    ]:
+        jobs.pop(job_id)
+
+
+def submit(label, fn, *args, owner=None, **kwargs):
+    # Queues fn(job, *args, **kwargs). fn must not call st.* elements; it reports
+    # through progress() and should stop early once job["cancel"] is set.
+    runner = _runner()
+    job = {
+        "id": uuid.uuid4().hex,
+        "label": label,
+        "owner": owner,
+        "status": "queued",
+        "done": 0,
+        "total": None,
+        "rate": 0.0,
+        "result": None,
+        "error": None,
+        "cancel": threading.Event(),
+        "created_at": time.time(),
+        "finished_at": None,
+    }
+    # Lets the worker use the shared caches (data layer) without context warnings
+    ctx = get_script_run_ctx()
+
+    def _run():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        if job["cancel"].is_set():
+            job["status"] = "cancelled"
+            job["finished_at"] = time.time()
+            return
+        job["status"] = "running"
+        try:
+            job["result"] = fn(job, *args, **kwargs)
+            job["status"] = "cancelled" if job["cancel"].is_set() else "done"
+        except Exception as e:
+            job["error"] = getattr(e, "message", None) or str(e) or type(e).__name__
+            job["status"] = "failed"
+        finally:
+            job["finished_at"] = time.time()
+
+    with runner["lock"]:
+        _prune(runner["jobs"])
+        runner["jobs"][job["id"]] = job
+    runner["pool"].submit(_run)
+    return job["id"]
+
+
+def progress(job, done, total, rate):
+    job["done"], job["total"], job["rate"] = done, total, rate
+
+
+def cancel(job_id):
+    job = _runner()["jobs"].get(job_id)
+    if job is not None:
+        job["cancel"].set()
+
+
+def list_jobs(owner=None):
+    runner = _runner()
+    with runner["lock"]:
+        jobs = list(runner["jobs"].values())
+    return sorted(
+        (j for j in jobs if owner is None or j["owner"] == owner),
+        key=lambda j: j["created_at"],
+        reverse=True,
+    )
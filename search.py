@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+import data
+
+# In-process full-text search over the buyers table. Every field is tokenized
+# once per data version into an inverted index whose vocabulary is sorted, so
+# the terms starting with a prefix are one contiguous range of postings.
+FIELD_WEIGHTS = {"entity": 4.0, "ticker": 4.0, "intel": 1.5, "description": 1.0}
+TOKEN_PATTERN = r"[a-z0-9]+"
+MIN_PREFIX = 2  # shorter query tokens only match whole terms
+PREFIX_WEIGHT = 0.7  # a term merely starting with the query token counts less
+
+
+def _tokens(values):
+    # Lower-cased, accent-folded word tokens of a string Series, one list per row
+    text = (
+        pd.Series(values, dtype="string")
+        .str.normalize("NFKD")
+        .str.encode("ascii", errors="ignore")
+        .str.decode("ascii")
+        .str.lower()
+    )
+    return text.str.findall(TOKEN_PATTERN)
+
+
+class SearchIndex:
+    def __init__(self, df, fields=FIELD_WEIGHTS):
+        self.n = len(df)
+        rows, terms, boosts = [], [], []
+        for field, boost in fields.items():
+            if field in df.columns:
+                tokens = _tokens(df[field].to_numpy()).explode().dropna()
+                rows.append(tokens.index.to_numpy(dtype=np.int64))
+                terms.append(tokens.to_numpy(dtype=object))
+                boosts.append(np.full(len(tokens), boost))
+        if not rows:
+            rows, terms, boosts = [np.empty(0, np.int64)], [np.empty(0, object)], [np.empty(0)]
+
+        # Sorted vocabulary; hashing first keeps the sort to the distinct terms
+        codes, vocab = pd.factorize(np.concatenate(terms))
+        order = np.argsort(vocab)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        self.vocab = vocab[order]
+
+        # Postings sorted by (term, row): one entry per row and term, weighted
+        # by the boosted, sublinear frequency of the term in that row
+        keys, inverse = np.unique(rank[codes] * max(self.n, 1) + np.concatenate(rows), return_inverse=True)
+        freq = np.bincount(inverse, weights=np.concatenate(boosts))
+        term = keys // max(self.n, 1)
+        self.rows = keys % max(self.n, 1)
+        doc_freq = np.bincount(term, minlength=len(self.vocab))
+        idf = np.log1p(self.n / np.maximum(doc_freq, 1))
+        self.weights = (np.log1p(freq) * idf[term]).astype(np.float32)
+        self.offsets = np.concatenate(([0], np.cumsum(doc_freq)))
+
+    def _postings(self, token):
+        # (rows, weights) of the terms matching a query token
+        lo = np.searchsorted(self.vocab, token, side="left")
+        exact = lo < len(self.vocab) and self.vocab[lo] == token
+        if len(token) < MIN_PREFIX:
+            hi = lo + 1 if exact else lo
+        else:
+            hi = np.searchsorted(self.vocab, token + "\uffff", side="left")
+        start, end = self.offsets[lo], self.offsets[hi]
+        weights = self.weights[start:end]
+        if hi - lo > int(exact):
+            # Down-weight prefix-only matches; exact ones are the first term
+            weights = weights * PREFIX_WEIGHT
+            if exact:
+                weights[: self.offsets[lo + 1] - start] /= PREFIX_WEIGHT
+        return self.rows[start:end], weights
+
+    def scores(self, query):
+        # Relevance of every row for `query` (every token must match; prefixes
+        # count), 0 where it doesn't match; None for an empty query
+        tokens = list(dict.fromkeys(_tokens([query]).iloc[0] or []))
+        if not tokens:
+            return None
+        total = np.zeros(self.n, dtype=np.float32)
+        matched = np.ones(self.n, dtype=bool)
+        for token in tokens:
+            rows, weights = self._postings(token)
+            score = np.bincount(rows, weights=weights, minlength=self.n)
+            matched &= score > 0
+            total += score
+        return np.where(matched, total, 0).astype(np.float32)
+
+
+def index(df):
+    return data.derived(SearchIndex, df)
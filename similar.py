@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+
+import comps
+import data
+import filters
+
+# "Find comparable companies": nearest neighbours of an entity by cosine
+# similarity over three blocks, mixed with BLOCK_WEIGHTS:
+#   text       TF-IDF of description words and ciq_industry_category labels
+#   labels     one-hots of micros, macros, country and ciq_industry
+#   financials percentile-normalized comps metrics
+BLOCK_WEIGHTS = {"text": 0.5, "labels": 0.3, "financials": 0.2}
+LABEL_COLUMNS = ("micros", "macros", "country", "ciq_industry")
+CATEGORY_COLUMN = "ciq_industry_category"
+TOKEN_PATTERN = r"[a-z][a-z0-9]+"
+MIN_DF = 2  # terms in fewer descriptions are dropped
+MAX_DF = 0.5  # ... and so are terms in more than this share of them
+STOP_WORDS = frozenset(
+    "and the for with its our are from that this which into has have was were "
+    "company companies inc ltd other provides offers based founded headquartered "
+    "products services also well through under".split()
+)
+
+
+class _Sparse:
+    # Row-normalized sparse matrix kept both ways: by row (to read a query
+    # row's entries) and by column (to find the rows sharing them)
+    def __init__(self, rows, cols, weights, n_rows):
+        self.n = n_rows
+        norms = np.sqrt(np.bincount(rows, weights=weights**2, minlength=n_rows))
+        weights = (weights / np.where(norms > 0, norms, 1)[rows]).astype(np.float32)
+
+        by_row = np.argsort(rows, kind="stable")
+        self.row_cols = cols[by_row]
+        self.row_weights = weights[by_row]
+        self.row_offsets = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n_rows))))
+
+        n_cols = int(cols.max()) + 1 if len(cols) else 0
+        by_col = np.argsort(cols, kind="stable")
+        self.col_rows = rows[by_col]
+        self.col_weights = weights[by_col]
+        self.col_offsets = np.concatenate(([0], np.cumsum(np.bincount(cols, minlength=n_cols))))
+
+    def scores(self, row):
+        # Cosine similarity of every row with `row`
+        lo, hi = self.row_offsets[row], self.row_offsets[row + 1]
+        if lo == hi:
+            return np.zeros(self.n, dtype=np.float32)
+        cols, weights = self.row_cols[lo:hi], self.row_weights[lo:hi]
+        starts, ends = self.col_offsets[cols], self.col_offsets[cols + 1]
+        entries = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+        query = np.repeat(weights, ends - starts)
+        return np.bincount(
+            self.col_rows[entries], weights=self.col_weights[entries] * query, minlength=self.n
+        ).astype(np.float32)
+
+
+def _text(df, index):
+    # (row, term) pairs with sublinear TF-IDF weights
+    n = len(df)
+    rows, terms = [], []
+    if "description" in df.columns:
+        words = pd.Series(df["description"].to_numpy(), dtype="string").str.lower().str.findall(TOKEN_PATTERN)
+        words = words.explode().dropna()
+        words = words[(words.str.len() > 2) & ~words.isin(STOP_WORDS)]
+        rows.append(words.index.to_numpy(dtype=np.int64))
+        terms.append(words.to_numpy(dtype=object))
+    if CATEGORY_COLUMN in index:
+        # Whole category labels are terms of their own
+        idx = index[CATEGORY_COLUMN]
+        rows.append(idx.rows)
+        terms.append(np.char.add("category:", idx.labels.astype(str))[idx.entry_codes].astype(object))
+    if not rows:
+        return _Sparse(np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0), n)
+
+    codes, vocab = pd.factorize(np.concatenate(terms))
+    pairs, tf = np.unique(np.concatenate(rows) * len(vocab) + codes, return_counts=True)
+    rows, codes = pairs // len(vocab), pairs % len(vocab)
+
+    df_counts = np.bincount(codes, minlength=len(vocab))
+    keep = (df_counts[codes] >= MIN_DF) & (df_counts[codes] <= MAX_DF * n)
+    idf = np.log((1 + n) / (1 + df_counts)) + 1
+    weights = (1 + np.log(tf)) * idf[codes]
+    return _Sparse(rows[keep], codes[keep], weights[keep], n)
+
+
+def _labels(n, index):
+    # One-hots of every label column, as one matrix with offset label codes
+    rows, cols, offset = [], [], 0
+    for col in LABEL_COLUMNS:
+        if col in index:
+            rows.append(index[col].rows)
+            cols.append(index[col].entry_codes + offset)
+            offset += len(index[col].labels)
+    if not rows:
+        return _Sparse(np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0), n)
+    rows = np.concatenate(rows)
+    return _Sparse(rows, np.concatenate(cols), np.ones(len(rows)), n)
+
+
+def _financials(df):
+    # Percentile ranks centred on 0 (missing -> 0), so skewed multiples and
+    # margins weigh alike; rows L2-normalized for cosine similarity
+    metrics = [m for m in comps.METRIC_COLUMNS if m in df.columns]
+    if not metrics:
+        return np.zeros((len(df), 0), dtype=np.float32)
+    values = df[metrics].apply(pd.to_numeric, errors="coerce").rank(pct=True) - 0.5
+    values = values.fillna(0).to_numpy(dtype=np.float32)
+    norms = np.linalg.norm(values, axis=1, keepdims=True)
+    return values / np.where(norms > 0, norms, 1)
+
+
+class SimilarityIndex:
+    def __init__(self, df, index, weights=BLOCK_WEIGHTS):
+        self.n = len(df)
+        self.weights = weights
+        self.position = {str(i): p for p, i in enumerate(df["id"].tolist())} if "id" in df.columns else {}
+        self.text = _text(df, index)
+        self.labels = _labels(self.n, index)
+        self.financials = _financials(df)
+
+    def scores(self, row):
+        # Weighted cosine similarity of every entity with the one at position `row`
+        return (
+            self.weights["text"] * self.text.scores(row)
+            + self.weights["labels"] * self.labels.scores(row)
+            + self.weights["financials"] * (self.financials @ self.financials[row])
+        )
+
+    def top_k(self, entity_id, k=10):
+        # [(position, score), ...] of the k entities most similar to entity_id
+        row = self.position.get(str(entity_id))
+        if row is None:
+            return []
+        scores = self.scores(row)
+        scores[row] = -np.inf
+        k = min(k, self.n - 1)
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return list(zip(best.tolist(), scores[best].tolist()))
+
+
+def _build(df):
+    return SimilarityIndex(df, filters.engine(df).index)
+
+
+def engine(df):
+    return data.derived(_build, df)
+
+
+def similar(df, entity_id, k=10):
+    # The k entities of a loaded table most similar to entity_id, best first
+    hits = engine(df).top_k(entity_id, k)
+    out = df.iloc[[pos for pos, _ in hits]]
+    return out.assign(similarity=[score for _, score in hits])
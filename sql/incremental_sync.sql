@@ -0,0 +1,66 @@
+-- Change tracking for the app's incremental refresh (data.py, WATERMARK).
+--
+-- * entities.updated_at is bumped on every insert/update, and whenever one of
+--   the entity's micro links changes, so views built on entities see it too.
+-- * deleted_rows keeps a tombstone per deleted entity, so a refresh can drop
+--   rows it already holds.
+--
+-- buyers_table, entities_context and public must expose entities.updated_at
+-- as `updated_at`; a table without the column is simply reloaded in full.
+
+alter table entities add column if not exists updated_at timestamptz not null default now();
+create index if not exists entities_updated_at_idx on entities (updated_at);
+
+create or replace function public.touch_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.updated_at := now();
+  return new;
+end;
+$$;
+
+drop trigger if exists entities_touch_updated_at on entities;
+create trigger entities_touch_updated_at
+  before insert or update on entities
+  for each row execute function public.touch_updated_at();
+
+create or replace function public.touch_entity_from_link()
+returns trigger
+language plpgsql
+as $$
+begin
+  update entities set updated_at = now()
+  where id = coalesce(new.entity_id, old.entity_id);
+  return null;
+end;
+$$;
+
+drop trigger if exists buyer_micro_context_touch_entity on buyer_micro_context;
+create trigger buyer_micro_context_touch_entity
+  after insert or update or delete on buyer_micro_context
+  for each row execute function public.touch_entity_from_link();
+
+create table if not exists deleted_rows (
+  id bigserial primary key,
+  table_name text not null,
+  row_id text not null,
+  deleted_at timestamptz not null default now()
+);
+create index if not exists deleted_rows_lookup_idx on deleted_rows (table_name, deleted_at);
+
+create or replace function public.record_tombstone()
+returns trigger
+language plpgsql
+as $$
+begin
+  insert into deleted_rows (table_name, row_id) values (tg_table_name, old.id::text);
+  return null;
+end;
+$$;
+
+drop trigger if exists entities_tombstone on entities;
+create trigger entities_tombstone
+  after delete on entities
+  for each row execute function public.record_tombstone();
@@ -0,0 +1,80 @@
+-- Applies micro label assignments for many buyers in one transaction.
+--
+--   links: {"<entity_id>": ["Label A", "Label B"], ...}
+--
+-- Missing labels are added to micros, then each listed buyer's links in
+-- buyer_micro_context are made to match its list exactly (an empty list
+-- removes all of them). Buyers not in `links` are left untouched. Returns the
+-- labels it created as [{"id", "label"}] plus the link counts.
+--
+-- Called from the app with conn.client.rpc("sync_buyer_micros", {"links": ...}).
+-- Against a local Postgres:
+--   select public.sync_buyer_micros('{"42": ["Beauty", "Wellness"], "43": []}');
+
+create or replace function public.sync_buyer_micros(links jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+  labels_added jsonb;
+  n_inserted int;
+  n_deleted int;
+begin
+  -- New labels are returned so the app can extend its label list in place
+  with added as (
+    insert into micros (label)
+    select distinct btrim(l.label)
+    from jsonb_each(links) e
+    cross join lateral jsonb_array_elements_text(e.value) as l(label)
+    where btrim(l.label) <> ''
+    on conflict (label) do nothing
+    returning id, label
+  )
+  select coalesce(jsonb_agg(jsonb_build_object('id', id, 'label', label)), '[]'::jsonb)
+  into labels_added
+  from added;
+
+  -- entity_id arrives as text; jsonb_populate_record casts it to the column
+  -- type, so the comparisons below are on native columns and can use indexes
+  create temp table _desired on commit drop as
+  select distinct r.entity_id, r.micro_id
+  from jsonb_each(links) e
+  cross join lateral jsonb_array_elements_text(e.value) as l(label)
+  join micros m on m.label = btrim(l.label)
+  cross join lateral jsonb_populate_record(
+    null::buyer_micro_context,
+    jsonb_build_object('entity_id', e.key, 'micro_id', m.id)
+  ) r;
+
+  insert into buyer_micro_context (entity_id, micro_id)
+  select d.entity_id, d.micro_id
+  from _desired d
+  where not exists (
+    select 1 from buyer_micro_context b
+    where b.entity_id = d.entity_id and b.micro_id = d.micro_id
+  );
+  get diagnostics n_inserted = row_count;
+
+  delete from buyer_micro_context b
+  where b.entity_id in (
+      select r.entity_id
+      from jsonb_object_keys(links) k
+      cross join lateral jsonb_populate_record(
+        null::buyer_micro_context, jsonb_build_object('entity_id', k)
+      ) r
+    )
+    and not exists (
+      select 1 from _desired d
+      where d.entity_id = b.entity_id and d.micro_id = b.micro_id
+    );
+  get diagnostics n_deleted = row_count;
+
+  drop table _desired;
+
+  return jsonb_build_object(
+    'labels_added', labels_added,
+    'inserted', n_inserted,
+    'deleted', n_deleted
+  );
+end;
+$$;
@@ -0,0 +1,80 @@
+-- Checks sync_buyer_micros against a throwaway Postgres: adding links (and a
+-- new label), removing links, and an empty list. Runs in one transaction on
+-- minimal stand-in tables in a scratch schema and rolls everything back.
+--
+--   $ psql "$TEST_DATABASE_URL" -v ON_ERROR_STOP=1 -f sql/test_sync_buyer_micros.sql
+--
+-- Any failed check raises, so psql exits non-zero.
+
+begin;
+
+create schema sync_test;
+set local search_path = sync_test, public;
+
+create table entities (id bigint primary key);
+create table micros (id bigserial primary key, label text not null unique);
+create table buyer_micro_context (
+  entity_id bigint not null references entities (id),
+  micro_id bigint not null references micros (id),
+  primary key (entity_id, micro_id)
+);
+
+insert into entities values (42), (43);
+insert into micros (label) values ('Beauty'), ('Wellness'), ('Food');
+insert into buyer_micro_context
+select 43, id from micros where label in ('Beauty', 'Food');
+
+\ir sync_buyer_micros.sql
+
+create function pg_temp.links(entity bigint) returns text[]
+language sql as $$
+  select coalesce(array_agg(m.label order by m.label), '{}')
+  from buyer_micro_context b join micros m on m.id = b.micro_id
+  where b.entity_id = entity
+$$;
+
+-- Add: two existing labels, one new one (padded), blanks ignored
+do $$
+declare
+  res jsonb := public.sync_buyer_micros('{"42": ["Beauty", "Wellness", " Pet Care ", ""]}');
+begin
+  assert res -> 'inserted' = '3', format('add: inserted %s', res);
+  assert res -> 'deleted' = '0', format('add: deleted %s', res);
+  assert jsonb_array_length(res -> 'labels_added') = 1
+     and res -> 'labels_added' -> 0 ->> 'label' = 'Pet Care', format('add: labels_added %s', res);
+  assert pg_temp.links(42) = array['Beauty', 'Pet Care', 'Wellness'], format('add: links %s', pg_temp.links(42));
+  assert pg_temp.links(43) = array['Beauty', 'Food'], 'add: entity 43 must be untouched';
+end $$;
+
+-- Same call again: nothing to do, no label re-created
+do $$
+declare
+  res jsonb := public.sync_buyer_micros('{"42": ["Beauty", "Wellness", "Pet Care"]}');
+begin
+  assert res = '{"labels_added": [], "inserted": 0, "deleted": 0}', format('repeat: %s', res);
+end $$;
+
+-- Remove: 42 keeps one link; 43 swaps Food for Wellness
+do $$
+declare
+  res jsonb := public.sync_buyer_micros('{"42": ["Wellness"], "43": ["Beauty", "Wellness"]}');
+begin
+  assert res -> 'inserted' = '1', format('remove: inserted %s', res);
+  assert res -> 'deleted' = '3', format('remove: deleted %s', res);
+  assert pg_temp.links(42) = array['Wellness'], format('remove: links 42 %s', pg_temp.links(42));
+  assert pg_temp.links(43) = array['Beauty', 'Wellness'], format('remove: links 43 %s', pg_temp.links(43));
+end $$;
+
+-- Empty list: removes every link of that buyer only
+do $$
+declare
+  res jsonb := public.sync_buyer_micros('{"42": []}');
+begin
+  assert res = '{"labels_added": [], "inserted": 0, "deleted": 1}', format('empty: %s', res);
+  assert pg_temp.links(42) = '{}', format('empty: links 42 %s', pg_temp.links(42));
+  assert pg_temp.links(43) = array['Beauty', 'Wellness'], 'empty: entity 43 must be untouched';
+end $$;
+
+\echo 'sync_buyer_micros: all checks passed'
+
+rollback;
@@ -1,9 +1,10 @@
 import os, streamlit as st
-import pandas as pd
 import altair as alt
 from st_supabase_connection import SupabaseConnection
 from supabase import create_client
 from views import buyers
+import data
+import feed
 
 st.set_page_config(page_title="Igc Consumer", page_icon="🧴", layout="wide", initial_sidebar_state="expanded")
 alt.themes.enable("dark")
@@ -82,41 +83,16 @@ def main():
         if st.button("Sign out"):
             sign_out()
 
-    res_micro = conn.table("entities_context").select("*").execute()
-    df_micro = pd.DataFrame(res_micro.data or [])
-
-    # Buyers Table
-    res_buyers = conn.table("buyers_table").select("*").execute()
-    df_buyers = pd.DataFrame(res_buyers.data or [])
-
-    res_macro_labels = conn.table("macros").select("*").execute()
-    df_macro_labels = pd.DataFrame(res_macro_labels.data or [])
-
-    res_micro_labels = conn.table("micros").select("*").execute()
-    df_micro_labels = pd.DataFrame(res_micro_labels.data or [])
-    # Perform queries.
-    res = conn.table("entities").select("*").execute()
-    df = res.data
-
-    res = conn.table("public").select("*").execute()
-    public = res.data
-    # --------------
-
-    # Create DataFrame
-    df = pd.DataFrame(
-        df
-    )
-
-    public = pd.DataFrame(
-        public
-    )
-    # --------------
+    # Keep the shared cached tables current (opt in with CHANGE_FEED = true)
+    if feed.enabled():
+        feed.start(conn)
 
     st.title("Igc Consumer & Retail")
     tab1, tab2 = st.tabs(["Strategic Buyers", "Projects"])
     # --------------
 
     # with tab4: 
+    #     df_micro = data.Datasets(conn, ("entities_context",))["entities_context"]
     #     col = st.columns((6.5, 1.5), gap='medium')
 
     #     with col [0]:
@@ -150,6 +126,7 @@ def main():
     #         )
 
     # with tab3: 
+    #     df_micro = data.Datasets(conn, ("entities_context",))["entities_context"]
     #     col_tab2 = st.columns((6.5, 1.5), gap='medium')
 
     #     with col_tab2[1]:
@@ -167,10 +144,12 @@ def main():
 
     #         col_trading = st.columns((1, 1, 1, 1), gap='medium')
 
-    #         median_ev_rev = df_display["EV_Revenue_LTM"].median()
-    #         median_ev_ebitda = df_display["EV_EBITDA_LTM"].median()
-    #         median_ev_rev_fwd = df_display["EV_Revenue_FWD"].median()
-    #         median_ev_ebitda_fwd = df_display["EV_EBITDA_FWD"].median()
+    #         # Cached per data version and filter set (comps.py)
+    #         summary = comps.stats(df_micro.attrs["version"], df_micro, {"macros": options})
+    #         median_ev_rev = summary.loc["EV_Revenue_LTM", "median"]
+    #         median_ev_ebitda = summary.loc["EV_EBITDA_LTM", "median"]
+    #         median_ev_rev_fwd = summary.loc["EV_Revenue_FWD", "median"]
+    #         median_ev_ebitda_fwd = summary.loc["EV_EBITDA_FWD", "median"]
         
     #         with col_trading[0]:
     #             st.metric(label="**EV/Revenue (LTM)**", value=f"{median_ev_rev:,.2f}x", border=True, delta=0)
@@ -243,7 +222,7 @@ def main():
     #             submitted = st.form_submit_button("Add Entity")
 
     #             if submitted:
-    #                 data = {
+    #                 payload = {
     #                     "entity": entity,
     #                     "website": website,
     #                     "description": description,
@@ -255,10 +234,11 @@ def main():
     #                     "all_industries": all_industries,
     #                 }
 
-    #                 response = conn.table("entities").insert(data).execute()
+    #                 response = conn.table("entities").insert(payload).execute()
 
+    # Tabs declare the tables they read; nothing is fetched until a tab reads it.
     with tab1:
-        buyers.render(df_buyers, df_macro_labels, df_micro_labels, conn)
+        buyers.render(data.Datasets(conn, buyers.TABLES), conn)
 
     # event.selection
 
@@ -0,0 +1,124 @@
+import threading
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import data
+import taxonomy
+import uploads
+
+# Write-behind queue for buyer micro edits. Edits are coalesced per entity
+# (latest wins) in process-wide state and flushed as one RPC per batch.
+FLUSH_INTERVAL = 1.0  # seconds between background flushes
+FLUSH_SIZE = 50  # pending buyers that trigger a flush right away
+
+
+def _clean(labels):
+    return sorted({str(l).strip() for l in labels or [] if l is not None and str(l).strip()})
+
+
+def sync_micros(conn, links):
+    # links: {entity_id: [micro labels]}. Upserts the labels and applies the link
+    # diff for every listed buyer in ONE round trip / transaction
+    # (sql/sync_buyer_micros.sql).
+    payload = {str(bid): _clean(labels) for bid, labels in links.items()}
+    if not payload:
+        return {}
+    res = conn.client.rpc("sync_buyer_micros", {"links": payload}).execute()
+    result = res.data or {}
+    # The micros vocabulary is extended in place instead of being reloaded
+    taxonomy.add("micros", result.get("labels_added"))
+    data.invalidate("buyer_micro_context")
+    return result
+
+
+@st.cache_resource
+def _queue():
+    queue = {
+        "lock": threading.Lock(),
+        "flush_lock": threading.Lock(),  # one flush at a time keeps writes ordered
+        "wake": threading.Event(),
+        "conn": None,
+        "pending": {},  # entity_id -> labels
+        "failed": {},  # entity_id -> {"labels", "error"}
+    }
+    ctx = get_script_run_ctx()
+    threading.Thread(
+        target=_flusher, args=(queue, ctx), name="micros-flusher", daemon=True
+    ).start()
+    return queue
+
+
+def _flusher(queue, ctx):
+    # Lets the flusher use the shared caches without context warnings
+    add_script_run_ctx(threading.current_thread(), ctx)
+    while True:
+        queue["wake"].wait(FLUSH_INTERVAL)
+        queue["wake"].clear()
+        try:
+            _flush(queue)
+        except Exception:
+            pass  # transient: re-queued by _flush() for the next tick
+
+
+def enqueue(conn, links):
+    queue = _queue()
+    with queue["lock"]:
+        queue["conn"] = conn
+        queue["pending"].update({str(bid): _clean(labels) for bid, labels in links.items()})
+        full = len(queue["pending"]) >= FLUSH_SIZE
+    if full:
+        queue["wake"].set()
+
+
+def flush(conn=None):
+    # Writes everything pending now, on the calling thread; {entity_id: error}
+    return _flush(_queue(), conn)
+
+
+def _flush(queue, conn=None):
+    # Returns {entity_id: error} of the buyers rejected by this flush. A rejected
+    # batch is bisected, so only the bad buyers end up in "failed" (kept until
+    # retried). Transient failures put the batch back in the queue (unless a
+    # newer edit replaced it) for the next flush, and are raised.
+    with queue["flush_lock"]:
+        with queue["lock"]:
+            batch, queue["pending"] = queue["pending"], {}
+            conn = conn or queue["conn"]
+        if not batch:
+            return {}
+        try:
+            _, rejected = uploads.bisect(
+                lambda part: sync_micros(conn, dict(part)),
+                list(batch.items()),
+                key=lambda item: item[0],
+                split=lambda e: not uploads.is_transient(e),
+            )
+        except Exception:
+            with queue["lock"]:
+                for bid, labels in batch.items():
+                    queue["pending"].setdefault(bid, labels)
+            raise
+        rejected = dict(rejected)
+        with queue["lock"]:
+            for bid, labels in batch.items():
+                if bid in rejected:
+                    queue["failed"][bid] = {"labels": labels, "error": rejected[bid]}
+                else:
+                    queue["failed"].pop(bid, None)
+        return rejected
+
+
+def retry_failed():
+    queue = _queue()
+    with queue["lock"]:
+        for bid, failure in queue["failed"].items():
+            queue["pending"].setdefault(bid, failure["labels"])
+    queue["wake"].set()
+
+
+def status():
+    # (pending entity ids, {entity_id: error})
+    queue = _queue()
+    with queue["lock"]:
+        return list(queue["pending"]), {b: f["error"] for b, f in queue["failed"].items()}
@@ -0,0 +1,49 @@
+import threading
+
+import streamlit as st
+
+# In-memory label lists of the label taxonomies (micros, macros), built once per
+# loaded table version and extended in place when labels are added. Label ids
+# are resolved server-side (sql/sync_buyer_micros.sql), so only labels are kept.
+
+
+class LabelMap:
+    def __init__(self, df):
+        self._lock = threading.Lock()
+        self._labels = {}  # ordered set
+        if "label" in df.columns:
+            self.add(df["label"].dropna().astype(str).tolist())
+
+    def add(self, labels):
+        with self._lock:
+            self._labels.update(dict.fromkeys(labels))
+
+    def labels(self):
+        # In table order, followed by labels added since it was loaded
+        with self._lock:
+            return list(self._labels)
+
+
+@st.cache_resource
+def _current():
+    # taxonomy name -> LabelMap of the most recently loaded version
+    return {}
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _build(name, version, _df):
+    return LabelMap(_df)
+
+
+def get(name, df):
+    # LabelMap of a loaded taxonomy table (ds["micros"], ds["macros"])
+    label_map = _build(name, df.attrs.get("version"), df)
+    _current()[name] = label_map
+    return label_map
+
+
+def add(name, rows):
+    # Records labels created server-side (rows of {"id", "label"}) without a refetch
+    label_map = _current().get(name)
+    if label_map is not None and rows:
+        label_map.add(r["label"] for r in rows)
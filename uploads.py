@@ -0,0 +1,126 @@
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+WORKERS = 4  # concurrent upsert requests
+RETRIES = 4  # attempts after the first one, for transient errors only
+BACKOFF = 0.5  # seconds; doubled on every retry, plus jitter
+
+# SQLSTATE classes worth retrying: connection (08), resources (53),
+# operator intervention (57), serialization failure / deadlock (40)
+TRANSIENT_SQLSTATES = ("08", "53", "57", "40")
+
+
+def _error_message(e):
+    return getattr(e, "message", None) or str(e) or type(e).__name__
+
+
+def is_transient(e):
+    if isinstance(e, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    code = str(getattr(e, "code", "") or "")
+    return code.startswith(TRANSIENT_SQLSTATES) or code in ("429", "500", "502", "503", "504")
+
+
+def _upsert(conn, table, batch, on_conflict):
+    for attempt in range(RETRIES + 1):
+        try:
+            res = conn.table(table).upsert(batch, on_conflict=on_conflict).execute()
+            return len(res.data or [])
+        except Exception as e:
+            if attempt == RETRIES or not is_transient(e):
+                raise
+            time.sleep(BACKOFF * 2**attempt + random.uniform(0, BACKOFF))
+
+
+def bisect(write, batch, key, split=None):
+    # Returns ([write results], [(key, error), ...]). A rejected batch is split
+    # in half until the bad items are isolated, so they don't sink the good
+    # ones. Errors for which split(e) is false are raised instead.
+    try:
+        return [write(batch)], []
+    except Exception as e:
+        if split is not None and not split(e):
+            raise
+        if len(batch) == 1:
+            return [], [(key(batch[0]), _error_message(e))]
+    mid = len(batch) // 2
+    results_a, failed_a = bisect(write, batch[:mid], key, split)
+    results_b, failed_b = bisect(write, batch[mid:], key, split)
+    return results_a + results_b, failed_a + failed_b
+
+
+def _send(conn, table, batch, key, on_conflict):
+    # (rows written, [(key, error), ...]). Only rejected rows are isolated; a
+    # transient error that outlasted the retries is raised for the whole batch
+    written, failed = bisect(
+        lambda part: _upsert(conn, table, part, on_conflict),
+        batch,
+        lambda row: row.get(key),
+        split=lambda e: not is_transient(e),
+    )
+    return sum(written), failed
+
+
+def upload(
+    conn,
+    table,
+    batches,
+    key,
+    total,
+    on_conflict=None,
+    workers=WORKERS,
+    on_progress=None,
+    should_stop=None,
+):
+    # Upserts `batches` (lists of row dicts) with a bounded worker pool.
+    # on_progress(done_rows, total, rows_per_sec) runs on the calling thread;
+    # once should_stop() is true no new batch is sent (in-flight ones finish).
+    # A transient error that outlasted the retries stops the upload the same
+    # way and is reported once as "error"; its batch counts as not sent.
+    on_conflict = on_conflict or key
+    written, failed, done = 0, [], 0
+    stopped, cancelled, error = False, False, None
+    started = time.time()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        batches = iter(batches)
+        while True:
+            # Keep at most two batches per worker in flight, so the row dicts
+            # of a large upload are never materialized all at once
+            cancelled = cancelled or bool(should_stop and should_stop())
+            stopped = cancelled or error is not None
+            for batch in () if stopped else batches:
+                pending[pool.submit(_send, conn, table, batch, key, on_conflict)] = len(batch)
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                size = pending.pop(future)
+                try:
+                    batch_written, batch_failed = future.result()
+                except Exception as e:
+                    if not is_transient(e):
+                        raise
+                    error = error or _error_message(e)
+                    continue
+                done += size
+                written += batch_written
+                failed.extend(batch_failed)
+            if on_progress is not None:
+                on_progress(done, total, done / max(time.time() - started, 1e-9))
+
+    return {
+        "written": written,
+        "failed": failed,
+        "skipped": total - done,
+        "cancelled": cancelled,
+        "error": error,
+        "seconds": time.time() - started,
+    }
@@ -1,80 +1,212 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import datetime
 import import_entities
+import comps
+import data
+import feed
+import filters
+import search
+import similar
+import sync
+import taxonomy
+
+
+# Tables this tab reads from the data layer
+TABLES = ("buyers_table", "macros", "micros", "entities_context")
+
+# Metrics the selected buyer is positioned on within its peer groups
+PEER_METRICS = {
+    "EV_EBITDA_LTM": "EV/EBITDA (LTM)",
+    "EV_Revenue_LTM": "EV/Revenue (LTM)",
+    "EBITDA_Margin_LTM": "EBITDA margin (LTM)",
+}
+PEER_GROUPS = ("micros", "macros", "country")
+SIMILAR_K = 10  # comparable companies listed for the selected buyer
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _labels(version, _engine):
+    # Keyed by the data-layer version token only, so no DataFrame is hashed;
+    # the buyer facets come straight from the engine's single exploded pass.
+    # Shared by every session, like the engine (don't mutate the lists).
+    return (
+        _engine.labels("country"),
+        sorted(_engine.labels("ciq_industry_category")),
+        sorted(_engine.labels("ciq_industry")),
+    )
 
 
-def render(df_buyers, df_macro_labels, df_micro_labels, conn):
-
-    # Keep id for internal use, drop mi_key; order intel columns after micros
-    df_buyers_display = df_buyers[
-        [
-            "id",  # kept for internal logic, hidden from the UI
-            "entity",
-            "website",
-            "ticker",
-            "macros",
-            "micros",
-            "intel",
-            "intel_date",
-            "country",
-            "description",
-            "ciq_industry",
-            "ciq_industry_category",
-        ]
-    ]
-
-    @st.cache_data(ttl=300)
-    def _labels(macro_df, micro_df, df_buyers):
-        return (
-            macro_df["label"].dropna().astype(str).tolist(),
-            micro_df["label"].dropna().astype(str).tolist(),
-            df_buyers["country"].dropna().unique().astype(str).tolist(),
-            sorted(
-                pd.Series(df_buyers["ciq_industry_category"])
-                .dropna()
-                .apply(lambda x: x if isinstance(x, list) else [x])
-                .explode()
-                .astype(str)
-                .str.strip()
-                .replace({"", "nan", "none", "null"}, pd.NA)
-                .dropna()
-                .drop_duplicates()
-                .tolist()
-            ),
-            sorted(
-                pd.Series(df_buyers["ciq_industry"])
-                .dropna()
-                .apply(lambda x: x if isinstance(x, list) else [x])
-                .explode()
-                .astype(str)
-                .str.strip()
-                .replace({"", "nan", "none", "null"}, pd.NA)
-                .dropna()
-                .drop_duplicates()
-                .tolist()
-            ),
+def _display(df):
+    # Display-ready buyers frame, derived once per data version (data.derived);
+    # other columns stay the cached frame's buffers.
+    # intel_date as a proper date so DateColumn is compatible.
+    if "intel_date" not in df.columns:
+        return df
+    return df.assign(
+        intel_date=pd.to_datetime(df["intel_date"], errors="coerce").dt.date
+    )
+
+
+def _ordinal(n):
+    suffix = "th" if 10 <= n % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return f"{n}{suffix}"
+
+
+def _peer_positions(ds, entity_id, row_labels):
+    # Percentiles of the selected buyer from the shared peer cube (entities_context
+    # is only loaded once a buyer is selected); its groups are its own labels
+    df = ds["entities_context"]
+    if "id" not in df.columns:
+        return
+    cube = comps.peers(df)
+    lines = []
+    for col in PEER_GROUPS:
+        for label in row_labels.get(col, []):
+            hit = cube.lookup(entity_id, col, label)
+            if hit is None:
+                continue
+            pct, peers = hit
+            parts = [
+                f"{name} at {_ordinal(round(pct[metric] * 100))} pct"
+                for metric, name in PEER_METRICS.items()
+                if not np.isnan(pct.get(metric, np.nan))
+            ]
+            if parts:
+                lines.append(f"**{label}** peers ({peers}): " + " · ".join(parts))
+    if lines:
+        st.caption("  \n".join(lines))
+
+
+def _similar_companies(ds, row):
+    # Nearest neighbours of the selected buyer by description, labels and
+    # financials; the index is built once per entities_context version
+    df = ds["entities_context"]
+    if "id" not in df.columns:
+        return
+    hits = similar.similar(df, row["id"], SIMILAR_K)
+    if hits.empty:
+        return
+    with st.expander(f"Comparable companies ({len(hits)})"):
+        st.dataframe(
+            hits[[c for c in ("entity", "ticker", "country", "micros", "similarity") if c in hits.columns]],
+            column_config={
+                "micros": st.column_config.ListColumn("Micros"),
+                "similarity": st.column_config.ProgressColumn(
+                    "Similarity", min_value=0.0, max_value=1.0, format="%.2f"
+                ),
+            },
+            hide_index=True,
         )
 
-    macro_labels, micro_labels, countries_labels, industries_labels, industry_labels = _labels(
-        df_macro_labels, df_micro_labels, df_buyers
+
+def _sync_status():
+    pending, failed = sync.status()
+    if not pending and not failed:
+        return
+    # Poll while writes are waiting, so the indicator clears once they land
+    st.fragment(_sync_status_panel, run_every=1.0 if pending else None)()
+
+
+def _sync_status_panel():
+    pending, failed = sync.status()
+    if pending:
+        st.caption(f"💾 Saving {len(pending)} buyer(s)…")
+    if failed:
+        with st.expander(f"⚠️ {len(failed)} buyer(s) could not be saved", expanded=True):
+            st.dataframe(
+                pd.DataFrame(list(failed.items()), columns=["entity_id", "error"]),
+                hide_index=True,
+            )
+            if st.button("Retry failed saves", key="retry_micros"):
+                sync.retry_failed()
+                st.rerun()
+
+
+def render(ds, conn):
+    # The display columns (id kept for internal logic, hidden from the UI) are
+    # fetched once per data version; filtering happens locally on that copy.
+    # On a cold cache the first pages are shown while the rest stream in.
+    loading = st.empty()
+
+    def _show_partial(df_partial, total):
+        with loading.container():
+            st.caption(f"Loading buyers… {len(df_partial)} of {total}")
+            st.dataframe(df_partial.drop(columns=["id"]), hide_index=True)
+
+    df_buyers = ds.query("buyers_table", data.BUYER_COLUMNS, on_page=_show_partial)
+    loading.empty()
+
+    if df_buyers.attrs.get("truncated"):
+        st.warning(
+            f"Only {len(df_buyers)} of {df_buyers.attrs['total']} buyers could be loaded."
+        )
+
+    df_macro_labels = ds["macros"]
+    df_micro_labels = ds["micros"]
+
+    # Label membership is indexed once per data version, so any filter
+    # combination (and the facet counts) is a handful of NumPy operations
+    engine = filters.engine(df_buyers)
+
+    # Taxonomy label lists are built once per loaded version and extended in
+    # place when a save creates labels, so the vocabularies aren't refetched
+    macro_labels = taxonomy.get("macros", df_macro_labels).labels()
+    micro_labels = taxonomy.get("micros", df_micro_labels).labels()
+    countries_labels, industries_labels, industry_labels = _labels(
+        df_buyers.attrs["version"], engine
+    )
+
+    # Selections live in session state: the counts shown next to each option
+    # depend on the other filters, and a widget whose options change is rebuilt.
+    selected = st.session_state.setdefault(
+        "buyer_filters", {col: [] for col in filters.LABEL_COLUMNS}
+    )
+    counts = engine.facet_counts(selected)
+    changed = False
+
+    def _facet(name, col, options):
+        nonlocal changed
+        col_counts = counts.get(col, {})
+        chosen = st.multiselect(
+            name,
+            options,
+            default=[v for v in selected[col] if v in options],
+            format_func=lambda v: f"{v} ({col_counts.get(v, 0)})",
+        )
+        if chosen != selected[col]:
+            selected[col] = chosen
+            changed = True
+        return chosen
+
+    # Full-text search, ranked; the index is built on the first query of a version
+    query = st.text_input(
+        "Search buyers",
+        key="buyer_search",
+        placeholder="Search company, ticker, description or intel",
+        label_visibility="collapsed",
     )
 
     col_filter = st.columns((1, 1, 1, 1, 1, 1), gap="medium")
     with col_filter[1]:
-        macros = st.multiselect("Macro", macro_labels)
+        macros = _facet("Macro", "macros", macro_labels)
 
     with col_filter[2]:
-        micros = st.multiselect("Micro", micro_labels)
+        micros = _facet("Micro", "micros", micro_labels)
 
     with col_filter[3]:
-        countries = st.multiselect("Country", countries_labels)
+        countries = _facet("Country", "country", countries_labels)
 
     with col_filter[4]:
-        industry = st.multiselect("Industry", industry_labels)
+        industry = _facet("Industry", "ciq_industry", industry_labels)
 
     with col_filter[5]:
-        industries = st.multiselect("Industries", industries_labels)
+        industries = _facet("Industries", "ciq_industry_category", industries_labels)
+
+    # Redraw once so every facet shows counts for the new selection
+    if changed:
+        st.rerun()
 
     with col_filter[0]:
         selection = st.segmented_control(
@@ -85,43 +217,31 @@ def render(df_buyers, df_macro_labels, df_micro_labels, conn):
             default="View",
         )
 
-    to_set = (
-        lambda v: (
-            set(map(lambda x: str(x).strip(), v))
-            if isinstance(v, list)
-            else ({str(v).strip()} if pd.notna(v) else set())
-        )
+    mask = engine.mask(
+        {
+            "macros": macros,
+            "micros": micros,
+            "country": countries,
+            "ciq_industry": industry,
+            "ciq_industry_category": industries,
+        }
     )
-    mask = pd.Series(True, index=df_buyers_display.index)
-    if macros:
-        mask &= df_buyers_display["macros"].apply(
-            lambda v: bool(to_set(v) & set(map(str, macros)))
-        )
-    if micros:
-        mask &= df_buyers_display["micros"].apply(
-            lambda v: bool(to_set(v) & set(map(str, micros)))
-        )
-    if countries:
-        mask &= df_buyers_display["country"].apply(
-            lambda v: bool(to_set(v) & set(map(str, countries)))
-        )
-    if industry:
-        mask &= df_buyers_display["ciq_industry"].apply(
-            lambda v: bool(to_set(v) & set(map(str, industry)))
-        )
-    if industries:
-        mask &= df_buyers_display["ciq_industry_category"].apply(
-            lambda v: bool(to_set(v) & set(map(str, industries)))
-        )
-
-    # df_view keeps id internally; we will hide it in the UI
-    df_view = df_buyers_display[mask].copy()
 
-    # Ensure intel_date is a proper date so DateColumn is compatible
-    if "intel_date" in df_view.columns:
-        df_view["intel_date"] = pd.to_datetime(
-            df_view["intel_date"], errors="coerce"
-        ).dt.date
+    # The search narrows the same mask; its matches are listed best first
+    scores = None
+    if query.strip():
+        scores = search.index(df_buyers).scores(query)
+    if scores is not None:
+        mask &= scores > 0
+
+    # df_view keeps id internally; we will hide it in the UI. The session only
+    # holds row positions into the shared frame: no filter means no copy, and
+    # a filter gathers just the matching rows.
+    df_shared = data.derived(_display, df_buyers)
+    rows = np.flatnonzero(mask)
+    if scores is not None:
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+    df_view = df_shared if scores is None and len(rows) == len(df_shared) else df_shared.take(rows)
 
     config = {
         "website": st.column_config.LinkColumn(
@@ -167,10 +287,15 @@ def render(df_buyers, df_macro_labels, df_micro_labels, conn):
         ),
     }
 
-    # We hide "id" from the displayed dataframes/editors
+    # We hide "id" from the displayed dataframes/editors (a view, no copy)
     df_view_display = df_view.drop(columns=["id"])
 
     if selection == "View":
+        # Pick up other analysts' changes once the change feed lands them
+        # (not while editing, so a rerun never interrupts typing)
+        if feed.enabled():
+            feed.watch("buyers_table", data.BUYER_COLUMNS, df_buyers.attrs["version"])
+
         st.dataframe(
             df_view_display,
             key="buyers_view",
@@ -181,174 +306,51 @@ def render(df_buyers, df_macro_labels, df_micro_labels, conn):
         )
 
     elif selection == "Edit":
-        edited = st.data_editor(
-            df_view_display,
+        # The editor applies edits to Python lists rather than Arrow ones, so
+        # the label columns of the shown rows are decoded from the encoding
+        encoded = data.labels(df_buyers)
+        st.data_editor(
+            df_view_display.assign(
+                **{col: encoded[col].values(rows) for col in encoded if col in df_view_display.columns}
+            ),
             key="buyers_edit",
             column_config=config,
             hide_index=True,
         )
 
-        # ---------- FAST BATCH AUTOSAVE ----------
-        import time
-        from itertools import chain
-
-        def _as_list(x):
-            if isinstance(x, list):
-                return x
-            if x is None:
-                return []
-            s = str(x).strip()
-            if s.startswith("[") and s.endswith("]"):
-                return [
-                    t.strip(" '\"")
-                    for t in s.strip("[]").split(",")
-                    if t.strip()
-                ]
-            return [t.strip() for t in s.split(",") if t.strip()]
-
-        # We no longer rely on an "id" column in `edited` (it's hidden),
-        # we map by index back to df_view to get the real entity id.
-        if "micros" in edited.columns and "id" in df_view.columns:
-
-            # Build current UI snapshot: buyer_id -> list of micros
-            ui_by_id = {
-                str(df_view.loc[idx, "id"]): _as_list(row["micros"])
-                for idx, row in edited.iterrows()
-            }
+        # ---------- WRITE-BEHIND AUTOSAVE ----------
 
-            # Debounce: only save at most once every 1.0s
-            now = time.time()
-            last_ts = st.session_state.get("last_fast_sync_ts", 0.0)
-            changed_since_last = (
-                st.session_state.get("last_synced_micros") is None
-                or any(
-                    sorted(ui_by_id.get(k, []))
-                    != st.session_state.get(
-                        "last_synced_micros", {}
-                    ).get(k, [])
-                    for k in ui_by_id
-                )
-            )
+        # Only the cells changed in the editor are inspected: its session state
+        # holds edited_rows = {row position: {column: new value}}, and df_view
+        # shares those positions, so the real entity id is a positional lookup.
+        edited_rows = st.session_state.get("buyers_edit", {}).get("edited_rows", {})
+        if "micros" in df_view.columns and "id" in df_view.columns:
+            ids = df_view["id"]
 
-            if changed_since_last and (now - last_ts) > 1.0:  # adjust window if needed
-                try:
-                    from itertools import chain
-
-                    # 1) Collect ALL labels used across changed buyers
-                    prev = st.session_state.get("last_synced_micros", {})
-                    changed_ids = [
-                        bid
-                        for bid in ui_by_id
-                        if prev.get(bid) != sorted(ui_by_id[bid])
-                    ]
-                    if not changed_ids:
-                        st.session_state["last_fast_sync_ts"] = now
-                        st.session_state["last_synced_micros"] = {
-                            k: sorted(v) for k, v in ui_by_id.items()
-                        }
-                        st.stop()
-
-                    labels_needed = sorted(
-                        {
-                            lab
-                            for lab in chain.from_iterable(
-                                ui_by_id[bid] for bid in changed_ids
-                            )
-                            if lab
-                        }
-                    )
+            # buyer_id -> list of micros, for rows whose micros were edited
+            ui_by_id = {
+                str(ids.iloc[int(pos)]): list(changes["micros"] or [])
+                for pos, changes in edited_rows.items()
+                if "micros" in changes and int(pos) < len(ids)
+            }
 
-                    # 2) Upsert new labels in ONE call
-                    if labels_needed:
-                        conn.table("micros").upsert(
-                            [{"label": l} for l in labels_needed],
-                            on_conflict="label",
-                        ).execute()
-
-                    # 3) Fetch all their IDs in ONE call
-                    micro_rows = (
-                        conn.table("micros")
-                        .select("id,label")
-                        .in_("label", labels_needed)
-                        .execute()
-                        .data
-                        or []
-                    )
-                    label_to_id = {r["label"]: r["id"] for r in micro_rows}
-
-                    # 4) Fetch existing links for ALL changed buyers in ONE call
-                    links = (
-                        conn.table("buyer_micro_context")
-                        .select("entity_id,micro_id")
-                        .in_("entity_id", changed_ids)
-                        .execute()
-                        .data
-                        or []
-                    )
+            prev = st.session_state.get("last_synced_micros", {})
+            changed_ids = [
+                bid
+                for bid in ui_by_id
+                if prev.get(bid) != sorted(ui_by_id[bid])
+            ]
 
-                    current_by_buyer = {}
-                    for r in links:
-                        current_by_buyer.setdefault(
-                            str(r["entity_id"]), set()
-                        ).add(r["micro_id"])
-
-                    # 5) Build desired sets and compute bulk add/delete
-                    to_insert = []
-                    to_delete_map = {}  # buyer_id -> set(micro_id)
-                    for bid in changed_ids:
-                        desired_ids = {
-                            label_to_id[l]
-                            for l in ui_by_id[bid]
-                            if l in label_to_id
-                        }
-                        current_ids = current_by_buyer.get(bid, set())
-                        add_ids = desired_ids - current_ids
-                        del_ids = current_ids - desired_ids
-                        if add_ids:
-                            to_insert.extend(
-                                [
-                                    {
-                                        "entity_id": bid,
-                                        "micro_id": mid,
-                                    }
-                                    for mid in add_ids
-                                ]
-                            )
-                        if del_ids:
-                            to_delete_map[bid] = del_ids
-
-                    # 6) Apply bulk changes (ONE insert, ONE delete)
-                    if to_insert:
-                        conn.table("buyer_micro_context").insert(
-                            to_insert
-                        ).execute()
-
-                    # Delete by buyer in chunks
-                    if to_delete_map:
-                        for bid, mids in to_delete_map.items():
-                            (
-                                conn.table("buyer_micro_context")
-                                .delete()
-                                .eq("entity_id", bid)
-                                .in_("micro_id", list(mids))
-                                .execute()
-                            )
-
-                    # 7) Update local snapshot (no rerun)
-                    st.session_state["last_fast_sync_ts"] = now
-                    st.session_state["last_synced_micros"] = {
-                        k: sorted(v) for k, v in ui_by_id.items()
-                    }
-                    st.toast(
-                        f"Synced {len(changed_ids)} row(s).", icon="💾"
-                    )
+            if changed_ids:
+                # Hand the edits to the shared write-behind queue: repeated
+                # edits of a buyer coalesce and are flushed in batches
+                sync.enqueue(conn, {bid: ui_by_id[bid] for bid in changed_ids})
+                st.session_state["last_synced_micros"] = {
+                    **prev,
+                    **{bid: sorted(ui_by_id[bid]) for bid in changed_ids},
+                }
 
-                except Exception as e:
-                    st.error(
-                        getattr(e, "message", None)
-                        or str(e)
-                        or "Fast sync failed."
-                    )
+        _sync_status()
 
     st.caption(f"Entities shown: {len(df_view)}")
     # ----------------- BOTTOM ROW: FILE + INTEL PANEL -----------------
@@ -385,26 +387,11 @@ def render(df_buyers, df_macro_labels, df_micro_labels, conn):
             current_intel = selected_row.get("intel", "") if "intel" in selected_row else ""
             current_intel_date = selected_row.get("intel_date", None) if "intel_date" in selected_row else None
 
-            # current micros (ensure list of strings)
-            def _as_list_for_micros(x):
-                if isinstance(x, list):
-                    return [str(v).strip() for v in x if str(v).strip()]
-                if x is None:
-                    return []
-                s = str(x).strip()
-                if not s:
-                    return []
-                if s.startswith("[") and s.endswith("]"):
-                    return [
-                        t.strip(" '\"")
-                        for t in s.strip("[]").split(",")
-                        if t.strip()
-                    ]
-                return [t.strip() for t in s.split(",") if t.strip()]
-
-            current_micros = []
-            if "micros" in selected_row:
-                current_micros = _as_list_for_micros(selected_row["micros"])
+            # current labels, straight from the encoded columns (data.labels)
+            row_labels = {
+                col: column.row(rows[row_idx]) for col, column in data.labels(df_buyers).items()
+            }
+            current_micros = row_labels.get("micros", [])
 
             # normalize date for the widget:
             # - if it's a Timestamp, convert to date
@@ -416,6 +403,8 @@ def render(df_buyers, df_macro_labels, df_micro_labels, conn):
                 current_intel_date = datetime.date.today()
 
             st.badge(f"{selected_entity}")
+            _peer_positions(ds, selected_row["id"], row_labels)
+            _similar_companies(ds, selected_row)
 
             with st.form("intel_form"):
                 intel_date = st.date_input(
@@ -458,70 +447,16 @@ def render(df_buyers, df_macro_labels, df_micro_labels, conn):
                             }
                         ).eq("id", entity_id).execute()
 
-                        # 2) Sync micros for this single entity
-                        #    a) Upsert all selected micro labels
-                        labels_needed = sorted({lab for lab in micros_selected if lab})
-                        if labels_needed:
-                            conn.table("micros").upsert(
-                                [{"label": l} for l in labels_needed],
-                                on_conflict="label",
-                            ).execute()
-
-                            # b) Fetch their IDs
-                            micro_rows = (
-                                conn.table("micros")
-                                .select("id,label")
-                                .in_("label", labels_needed)
-                                .execute()
-                                .data
-                                or []
-                            )
-                            label_to_id = {r["label"]: r["id"] for r in micro_rows}
-
-                            # c) Fetch existing links for this entity
-                            links = (
-                                conn.table("buyer_micro_context")
-                                .select("entity_id,micro_id")
-                                .eq("entity_id", str(entity_id))
-                                .execute()
-                                .data
-                                or []
-                            )
-                            current_ids = {r["micro_id"] for r in links}
-
-                            desired_ids = {
-                                label_to_id[l]
-                                for l in micros_selected
-                                if l in label_to_id
-                            }
-
-                            add_ids = desired_ids - current_ids
-                            del_ids = current_ids - desired_ids
-
-                            # d) Insert new links
-                            if add_ids:
-                                to_insert = [
-                                    {"entity_id": str(entity_id), "micro_id": mid}
-                                    for mid in add_ids
-                                ]
-                                conn.table("buyer_micro_context").insert(
-                                    to_insert
-                                ).execute()
-
-                            # e) Delete removed links
-                            if del_ids:
-                                conn.table("buyer_micro_context") \
-                                    .delete() \
-                                    .eq("entity_id", str(entity_id)) \
-                                    .in_("micro_id", list(del_ids)) \
-                                    .execute()
-                        else:
-                            # If no micros selected, remove all existing for this entity
-                            conn.table("buyer_micro_context") \
-                                .delete() \
-                                .eq("entity_id", str(entity_id)) \
-                                .execute()
+                        # 2) Sync micros for this single entity (one RPC;
+                        #    an empty selection removes all its micros). Goes
+                        #    through the queue so older queued edits can't
+                        #    land after it.
+                        sync.enqueue(conn, {entity_id: micros_selected})
+                        error = sync.flush(conn).get(str(entity_id))
+                        if error:
+                            raise RuntimeError(error)
 
+                        data.invalidate("entities")
                         st.success("Saved.")
                     except Exception as e:
                         st.error(
@@ -546,6 +481,7 @@ def render(df_buyers, df_macro_labels, df_micro_labels, conn):
                             "intel": None,
                         }
                     ).eq("id", entity_id).execute()
+                    data.invalidate("entities")
                     st.success("Intel cleared (micros unchanged).")
                 except Exception as e:
                     st.error(